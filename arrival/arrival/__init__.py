@@ -1,5 +1,40 @@
-from .decoder import annotate, ocr, ocr_image, encode_number
-from .parser import Parser
-from .conscodec import ConsCodec
-from .galaxy import MachineImage
-from .space import SpaceClient
+import importlib
+
+# public names resolve on first use, so a bot that only needs ConsCodec
+# does not pay for numpy, PIL or requests
+_exports = {
+    'annotate': 'decoder',
+    'annotate_png': 'decoder',
+    'batch_ocr': 'decoder',
+    'ocr': 'decoder',
+    'ocr_image': 'decoder',
+    'encode_number': 'decoder',
+    'encode_numbers': 'decoder',
+    'number_atlas': 'decoder',
+    'Parser': 'parser',
+    'ConsCodec': 'conscodec',
+    'InteractionCache': 'cache',
+    'MachineImage': 'galaxy',
+    'SpaceClient': 'space',
+}
+
+_submodules = {'cache', 'conscodec', 'decoder', 'galaxy', 'galaxy_too_deep', 'gui',
+    'optimizer', 'parser', 'session', 'space', 'startup', '_galaxy'}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is not None:
+        value = getattr(importlib.import_module('.' + module, __name__), name)
+    elif name in _submodules:
+        value = importlib.import_module(f'{__name__}.{name}')
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports) | _submodules)
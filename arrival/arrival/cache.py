@@ -0,0 +1,59 @@
+import hashlib
+import sqlite3
+from array import array
+
+
+class InteractionCache:
+    def __init__(self, fn, limit=100000, salt=b''):
+        self.limit = limit
+        self.salt = hashlib.sha256(salt).digest()
+        self.db = sqlite3.connect(str(fn))
+        self.db.execute('create table if not exists interactions (key blob primary key, value blob, used integer)')
+        self.db.execute('create index if not exists interactions_used on interactions (used)')
+        self.clock, self.count = self.db.execute('select coalesce(max(used), 0), count(*) from interactions').fetchone()
+        # lookups only bump used in memory; written out with the next put or close
+        self.touched = dict()
+
+    def key(self, image):
+        h = hashlib.sha256(self.salt)
+        try:
+            h.update(array('q', image).tobytes())
+        except OverflowError:
+            return
+        return h.digest()
+
+    def get(self, key):
+        if key is None: return
+        row = self.db.execute('select value from interactions where key = ?', (key,)).fetchone()
+        if row is None: return
+        self.clock += 1
+        self.touched[key] = self.clock
+        return array('q', row[0]).tolist()
+
+    def put(self, key, image):
+        if key is None: return
+        try:
+            value = array('q', image).tobytes()
+        except OverflowError:
+            return
+        self.clock += 1
+        self._flush_touched()
+        cursor = self.db.execute('insert or ignore into interactions values (?, ?, ?)', (key, value, self.clock))
+        self.count += cursor.rowcount
+        if self.count > self.limit:
+            self._evict(self.count - self.limit)
+        self.db.commit()
+
+    def _flush_touched(self):
+        if self.touched:
+            self.db.executemany('update interactions set used = ? where key = ?', [(v, k) for k, v in self.touched.items()])
+            self.touched.clear()
+
+    def _evict(self, n):
+        cursor = self.db.execute('delete from interactions where key in (select key from interactions order by used limit ?)', (n,))
+        self.count -= cursor.rowcount
+
+    def close(self):
+        self._flush_touched()
+        self.db.commit()
+        self.db.close()
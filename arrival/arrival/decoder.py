@@ -1,28 +1,75 @@
 #!/usr/bin/env python3
+import hashlib
 import html
-import io
+import json
 import math
 import numpy as np
-from PIL import Image, ImageDraw
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image, ImageDraw, ImageFont
+
+
+def _number_bits(ns):
+    mag = np.abs(np.asarray(ns, dtype=np.int64)).astype(np.uint64)
+    bits = np.unpackbits(mag.astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    width = 64 - np.argmax(bits[:, ::-1], axis=1)
+    width[~bits.any(axis=1)] = 0
+    side = np.ceil(np.sqrt(np.maximum(width, 1))).astype(np.int64)
+    return bits, side
 
 
 def encode_number(n):
+    n = int(n)
     neg, n = n < 0, abs(n)
-    w = 1 + (1 if n == 0 else math.ceil(math.sqrt(1 + int(math.log2((n))))))
+    side = math.isqrt(max(1, n.bit_length()) - 1) + 1
+    w = 1 + side
     h = w + neg
     g = np.zeros((h, w), dtype=np.uint8)
     g[h-1, 0] = neg
-    for i in range(1, w):
-        g[0, i] = 1
-        g[i, 0] = 1
-    mask = 1
-    for y in range(1, w):
-        for x in range(1, w):
-            g[y, x] = 1 if (n & mask) else 0
-            mask <<= 1
+    g[0, 1:] = 1
+    g[1:w, 0] = 1
+    data = np.frombuffer(n.to_bytes((side * side + 7) // 8, 'little'), dtype=np.uint8)
+    bits = np.unpackbits(data, count=side * side, bitorder='little')
+    g[1:w, 1:] = bits.reshape((side, side))
     return g
 
 
+def encode_numbers(ns):
+    ns = np.asarray(ns, dtype=np.int64).reshape(-1)
+    bits, side = _number_bits(ns)
+    neg = (ns < 0).astype(np.int64)
+    w = side + 1
+    h = w + neg
+
+    count = len(ns)
+    glyphs = np.zeros((count, (h.max() if count else 0), (w.max() if count else 0)), dtype=np.uint8)
+    Y, X = np.indices(glyphs.shape[1:])
+    Y, X = Y[None], X[None]
+    wb, sb = w[:, None, None], side[:, None, None]
+    glyphs[((Y == 0) & (X >= 1) & (X < wb)) | ((X == 0) & (Y >= 1) & (Y < wb))] = 1
+    glyphs[(Y == h[:, None, None] - 1) & (X == 0) & (neg[:, None, None] != 0)] = 1
+
+    inner = (Y >= 1) & (Y < wb) & (X >= 1) & (X < wb)
+    index = np.clip((Y - 1) * sb + (X - 1), 0, 63)
+    rows = np.broadcast_to(np.arange(count)[:, None, None], glyphs.shape)
+    glyphs[inner] = bits[rows[inner], index[inner]]
+    return glyphs
+
+
+def number_atlas(ns, columns=16, pad=1):
+    glyphs = encode_numbers(ns)
+    count, gh, gw = glyphs.shape
+    rows = -(-count // columns)
+    ch, cw = gh + pad, gw + pad
+    # ocr needs two blank lines past the last glyph to close its border
+    margin = max(pad, 2)
+    px = np.zeros((rows * ch - pad + 2 * margin, min(count, columns) * cw - pad + 2 * margin), dtype=np.uint8)
+    for i, g in enumerate(glyphs):
+        y, x = divmod(i, columns)
+        px[margin + y*ch:margin + y*ch + gh, margin + x*cw:margin + x*cw + gw] = g
+    return Image.fromarray(px * 255, mode='L').convert('RGB')
+
+
 class Decoder:
     symbols = dict()
     symbols[(2, 0)] = '$'
@@ -63,6 +110,44 @@ class Decoder:
     symbols[(7, 68191693600)] = 'pow2'
     symbols[(7, 68259412260)] = 'mdisp' # #34
 
+    templates = dict()
+    templates[','] = [[1,1], [1,1], [1,1], [1,1], [1,1]]
+    templates['['] = [[0,0,1], [0,1,1], [1,1,1], [0,1,1], [0,0,1]]
+    templates[']'] = [[1,0,0], [1,1,0], [1,1,1], [1,1,0], [1,0,0]]
+
+    _index = None
+    _index_symbols = None
+
+    def __init__(self):
+        cls = self.__class__
+        if (cls._index is None) or (cls._index_symbols != cls.symbols):
+            cls._index = cls._build_index()
+            cls._index_symbols = dict(cls.symbols)
+
+    @classmethod
+    def _build_index(cls):
+        def key(glyph):
+            glyph = np.pad(np.array(glyph, dtype=np.uint8), 1)
+            return (*glyph.shape, np.packbits(glyph).tobytes())
+
+        index = dict()
+        for sym, glyph in cls.templates.items():
+            index[key(glyph)] = (sym, np.shape(glyph))
+        for (w, n), sym in cls.symbols.items():
+            glyph = np.zeros((w, w), dtype=np.uint8)
+            glyph[0, :] = 1
+            glyph[:, 0] = 1
+            bits = (n >> np.arange((w - 1) * (w - 1), dtype=np.uint64)) & 1
+            glyph[1:, 1:] = bits.reshape((w - 1, w - 1))
+            index[key(glyph)] = (sym, (w, w))
+        return index
+
+    def _lookup_glyph(self, px, x, y, h, w):
+        if (x < 1) or (y < 1) or (y + h + 1 >= px.shape[0]) or (x + w + 1 >= px.shape[1]):
+            return
+        window = px[y-1:y+h+1, x-1:x+w+1]
+        return self._index.get((h + 2, w + 2, np.packbits(window != 0).tobytes()))
+
     def _extract_border(self, px, x, y, w, h):
         if ((x < 0) or (y < 0) or (w <= 0) or (h <= 0)
             or (y + h >= px.shape[0])
@@ -173,17 +258,10 @@ class Decoder:
             if (n := self._decode_1d_stream(s)) is not None:
                 return n, (2, len(s))
 
-        if (y + 5 < px.shape[0]) and (x + 2 < px.shape[1]):
-            px52 = px[y:y+5, x:x+2]
-            if np.all(px52 != 0) and np.all(self._extract_border(px, x=x-1, y=y-1, w=4, h=7) == 0):
-                return ',', (5, 2)
-        if (y + 5 < px.shape[0]) and (x + 3 < px.shape[1]):
-            px53 = px[y:y+5, x:x+3]
-            if np.all(self._extract_border(px, x=x-1, y=y-1, w=5, h=7) == 0):
-                if np.all(px53 == [[0,0,1], [0,1,1], [1,1,1], [0,1,1], [0,0,1]]):
-                    return '[', (5, 3)
-                if np.all(px53 == [[1,0,0], [1,1,0], [1,1,1], [1,1,0], [1,0,0]]):
-                    return ']', (5, 3)
+        if (y + 2 < px.shape[0]) and px[y + 2, x]:
+            for h, w in ((5, 2), (5, 3)):
+                if (r := self._lookup_glyph(px, x=x, y=y, h=h, w=w)) is not None:
+                    return r
 
         w = 1
         while (y + w < px.shape[0]) and (x + w < px.shape[1]) and px[y, x + w] and px[y + w, x]:
@@ -192,6 +270,10 @@ class Decoder:
             neg = (y + w < px.shape[0]) and (px[y + w, x] != 0)
 
         if w < 2: return
+        if px[y,x] and (not neg):
+            if (r := self._lookup_glyph(px, x=x, y=y, h=w, w=w)) is not None:
+                return r
+
         border = self._extract_border(px, x=x-1, y=y-1, w=w+2, h=w+2+neg)
         if np.any(border != 0): return
 
@@ -245,21 +327,79 @@ def ocr_image(im):
     return ocr(px)
 
 
+def _symbols_digest():
+    h = hashlib.sha1()
+    for k, v in sorted(Decoder.symbols.items()):
+        h.update(repr((k, v)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _ocr_file(fn):
+    with Image.open(fn) as im:
+        return [(symbol, [int(x) for x in box]) for symbol, box in ocr_image(im.convert('RGB'))]
+
+
+class OcrCache:
+    def __init__(self, fn=None):
+        self.fn = fn
+        self.entries = dict()
+        if fn and Path(fn).exists():
+            with open(fn) as fp:
+                # json has no tuples, keep entries shaped like fresh results
+                self.entries = {k: [tuple(x) for x in v] for k, v in json.load(fp).items()}
+
+    def key(self, data, digest=None):
+        h = hashlib.sha1(data)
+        h.update((digest or _symbols_digest()).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, symbols):
+        self.entries[key] = symbols
+
+    def save(self):
+        if not self.fn: return
+        with open(self.fn, 'w') as fp:
+            json.dump(self.entries, fp)
+
+
+def batch_ocr(files, cache=None, jobs=None):
+    cache = cache or OcrCache()
+    files = list(files)
+    digest = _symbols_digest()
+    keys = [cache.key(Path(fn).read_bytes(), digest=digest) for fn in files]
+    todo = dict()
+    for fn, key in zip(files, keys):
+        if (key not in todo) and (cache.get(key) is None):
+            todo[key] = fn
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {key: pool.submit(_ocr_file, fn) for key, fn in todo.items()}
+        for fn, key in zip(files, keys):
+            if (symbols := cache.get(key)) is None:
+                symbols = futures[key].result()
+                cache.put(key, symbols)
+            yield fn, symbols
+
+
 class Svg:
     def __init__(self, width, height, scale=1):
         self.width = width
         self.height = height
         self.scale = scale
         w, h = width * scale, height * scale
-        self.so = io.StringIO()
+        self.parts = list()
         self._print(f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" width="{w}" height="{h}">')
         self._print(f'<rect width="{w}" height="{h}" style="fill:black" />')
 
     def __str__(self):
-        return self.so.getvalue()
+        return ''.join(self.parts)
 
-    def _print(self, *args, **kwargs):
-        print(*args, file=self.so, **kwargs)
+    def _print(self, text):
+        self.parts.append(text)
+        self.parts.append('\n')
 
     def close(self):
         self._print('</svg>')
@@ -293,23 +433,64 @@ class Svg:
         text = html.escape(text)
         self._print(f'<text x="{x}" y="{y}" dominant-baseline="middle" text-anchor="middle" style="{style}">{text}</text>')
 
+    def pixels(self, px, fill=None, inset=0):
+        s = self.scale
+        self._print(f'<defs><pattern id="px" width="{s}" height="{s}" patternUnits="userSpaceOnUse">')
+        self.rect((0, 0, 1, 1), fill=fill, inset=inset)
+        self._print('</pattern></defs>')
+        d = ''.join(f'M{x0*s} {y*s}h{(x1-x0)*s}v{s}h-{(x1-x0)*s}z' for y, x0, x1 in _pixel_runs(px))
+        self._print(f'<path d="{d}" style="fill:url(#px)" />')
+
+
+def _pixel_runs(px):
+    lit = np.pad(px != 0, ((0, 0), (1, 1))).astype(np.int8)
+    edges = np.diff(lit, axis=1)
+    ys, x0 = np.nonzero(edges == 1)
+    _, x1 = np.nonzero(edges == -1)
+    return zip(ys.tolist(), x0.tolist(), x1.tolist())
+
+
+def _normalize(im):
+    px = (np.array(im)[:,:,0] != 0).astype(np.uint8)
+    scale = 0
+    for i in range(min(*px.shape)):
+        if px[i,i] == 0: break
+        scale += 1
+    if not scale: scale = 1
+    return px[::scale, ::scale]
+
+
+def annotate_png(im, scale=10):
+    px = _normalize(im)
+
+    inset = round(0.1 * scale)
+    cell = np.zeros((scale, scale), dtype=np.uint8)
+    cell[inset:scale-inset, inset:scale-inset] = 255
+    lit = np.kron(px, cell)
+    canvas = Image.fromarray(lit, mode='L').convert('RGBA')
+
+    overlay = Image.new('RGBA', canvas.size)
+    draw = ImageDraw.Draw(overlay)
+    font = ImageFont.load_default(size=2.5 * scale)
+    labels = list()
+    pad = round(0.2 * scale)
+    for symbol, box in ocr(px):
+        x0, y0, x1, y1 = (int(v) * scale for v in box)
+        draw.rectangle((x0 - pad, y0 - pad, x1 + pad - 1, y1 + pad - 1), fill=(0x33, 0x33, 0x33, 0x80))
+        labels.append(((x0 + x1) / 2, (y0 + y1) / 2, str(symbol)))
+
+    canvas = Image.alpha_composite(canvas, overlay)
+    draw = ImageDraw.Draw(canvas)
+    for x, y, text in labels:
+        draw.text((x, y), text, fill='yellow', font=font, anchor='mm', stroke_width=max(1, scale // 10), stroke_fill='black')
+    return canvas.convert('RGB')
+
 
 def annotate(im, scale=10, pad=3):
-    def normalize(im):
-        px = (np.array(im)[:,:,0] != 0).astype(np.uint8)
-        scale = 0
-        for i in range(min(*px.shape)):
-            if px[i,i] == 0: break
-            scale += 1
-        return px[::scale, ::scale]
-
-    px = normalize(im)
+    px = _normalize(im)
     svg = Svg(width=px.shape[1], height=px.shape[0], scale=scale)
 
-    for i, v in np.ndenumerate(px):
-        if v:
-            y, x = i
-            svg.rect((x, y, 1, 1), fill='#fff', inset=0.1)
+    svg.pixels(px, fill='#fff', inset=0.1)
 
     for symbol, box in ocr(px):
         x,y,w,h = box
@@ -325,12 +506,31 @@ def annotate(im, scale=10, pad=3):
 if __name__ == '__main__':
     import argparse
 
-    def main(fn):
-        with Image.open(fn) as im:
-            print(annotate(im))
+    def main(fn=None, output=None, batch=None, cache=None, jobs=None):
+        if fn:
+            with Image.open(fn) as im:
+                if output and Path(output).suffix == '.png':
+                    annotate_png(im).save(output)
+                elif output:
+                    Path(output).write_text(annotate(im))
+                else:
+                    print(annotate(im))
+
+        if batch:
+            cache = OcrCache(cache)
+            files = sorted(Path(batch).glob('*.png'))
+            try:
+                for fn, symbols in batch_ocr(files, cache=cache, jobs=jobs):
+                    print(json.dumps({'image': str(fn), 'symbols': symbols}), flush=True)
+            finally:
+                cache.save()
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('input', help='Message image to annotate')
+    parser.add_argument('input', nargs='?', help='Message image to annotate')
+    parser.add_argument('-o', '--output', metavar='FILE', help='Write annotation to file, .png or .svg')
+    parser.add_argument('-b', '--batch', metavar='DIR', help='OCR all images in directory, JSON lines output')
+    parser.add_argument('--cache', metavar='FILE', help='OCR results cache for batch mode')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes')
     args = parser.parse_args()
 
-    main(fn=args.input)
+    main(fn=args.input, output=args.output, batch=args.batch, cache=args.cache, jobs=args.jobs)
@@ -1,21 +1,94 @@
 import ctypes
 import sys
+import time
+from array import array
+from collections import deque
 from pathlib import Path
-from .space import SpaceClient
+from .cache import InteractionCache
 
 
-_known_tokens = 'ap cons nil neg c b s isnil car eq mul add lt div i t f cdr SCAN number FUN DEF galaxy GG'
+_known_tokens = 'ap cons nil neg c b s isnil car eq mul add lt div i t f cdr SCAN number FUN DEF galaxy GG REF'
 _Tokens = {s:i for i, s in enumerate(_known_tokens.split(), 1)}
 
+BOOT_SEQUENCE = [
+    (0, 0),
+    (0, 0),
+    (0, 0),
+    (0, 0),
+    (0, 0),
+    (0, 0),
+    (0, 0),
+    (0, 0),
+    (8, 4),
+    (2, -8),
+    (3, 6),
+    (0, -14),
+    (-4, 10),
+    (9, -3),
+    (-4, 10),
+    (1, 4),
+]
 
-class AlienProxy:
-    def __init__(self):
-        pass
+
+class ModulatingAlienProxy:
+    # alien data stays a machine image; libgalaxy converts it to and from the wire format
+    modulated = True
+
+    def __init__(self, transport, galaxy):
+        self.transport = transport
+        self.galaxy = galaxy
+
+    def send(self, data):
+        if not isinstance(data, MachineData):
+            data = MachineData(MachineImage().encode_lists(data))
+        text = self.galaxy.modulate(data.image)
+        print('<~', text.decode())
+        res = self.transport.send(text)
+        print('~>', res.decode())
+        return self.galaxy.demodulate(res)
+
+
+class LocalAlienProxy:
+    def __init__(self, responses=None):
+        self.responses = responses if callable(responses) else deque(responses or [])
+        self.sent = list()
+
+    def send(self, data):
+        self.sent.append(data)
+        if callable(self.responses):
+            return self.responses(data)
+        return self.responses.popleft()
+
+
+class MachineData:
+    # a value already in machine image form, spliced into images as is
+    def __init__(self, image):
+        self.image = image
+
+    def __repr__(self):
+        return f'MachineData({self.image!r})'
+
+
+class FrameData(MachineData):
+    # frame images kept as a machine image; iterating decodes one layer at a time
+    def __iter__(self):
+        return MachineImage().iter_images(self.image, start=0)
+
+    def __bool__(self):
+        return self.image[0] != MachineImage.TOKENS['nil']
+
+    def __repr__(self):
+        return f'FrameData({self.image!r})'
 
 
 class MachineImage:
     TOKENS = dict(_Tokens)
 
+    _CELL = object()
+
+    def __init__(self):
+        self.buffer = array('q')
+
     def emit_call(self, *args):
         ap, num, gg = map(self.TOKENS.__getitem__, 'ap number GG'.split())
         def emit(fn, args):
@@ -32,13 +105,17 @@ class MachineImage:
                     fringe.append((fn, args[:-1]))
         return list(emit(args[0], args[1:]))
 
-    def encode_lists(self, data):
+    def encode_lists(self, data, share=False):
+        if share:
+            return self.write_lists(array('q'), data, seen=dict()).tolist()
         ap, cons, num, nil, gg = map(self.TOKENS.__getitem__, 'ap cons number nil GG'.split())
         def encode(data):
             fringe = [data]
             while fringe:
                 item = fringe.pop()
-                if isinstance(item, tuple) and (len(item) == 1):
+                if isinstance(item, MachineData):
+                    yield from item.image
+                elif isinstance(item, tuple) and (len(item) == 1):
                     fringe.append(item[0])
                 elif isinstance(item, list) and (len(item) == 0):
                     yield nil
@@ -53,14 +130,77 @@ class MachineImage:
                     yield int(item)
         return list(encode(data))
 
+    def encode_call(self, *args, share=False):
+        # same image as emit_call, written into a buffer reused across calls
+        buf = self.buffer
+        del buf[:]
+        buf.extend([self.TOKENS['ap']] * (len(args) - 1))
+        buf.append(self.TOKENS[args[0]])
+        seen = dict() if share else None
+        for arg in args[1:]:
+            self.write_lists(buf, arg, seen=seen)
+        return buf
+
+    def write_lists(self, buf, data, seen=None):
+        # with seen, a list or tuple object written before is emitted as REF <offset>
+        ap, cons, num, nil, ref = map(self.TOKENS.__getitem__, 'ap cons number nil REF'.split())
+        cell = (ap, ap, cons)
+        stack = [data]
+        while stack:
+            item = stack.pop()
+            kind = type(item)
+            if (seen is not None) and ((kind is list and item) or (kind is tuple and len(item) > 1)):
+                if id(item) in seen:
+                    buf.append(ref)
+                    buf.append(seen[id(item)][0])
+                    continue
+                seen[id(item)] = (len(buf), item)
+            if kind is int:
+                buf.append(num)
+                buf.append(item)
+            elif isinstance(item, MachineData):
+                buf.extend(item.image)
+            elif item is self._CELL:
+                buf.extend(cell)
+            elif kind is list:
+                if all(type(x) is int for x in item):
+                    for x in item:
+                        buf.extend((ap, ap, cons, num, x))
+                    buf.append(nil)
+                else:
+                    stack.append([])
+                    for x in reversed(item):
+                        stack.append(x)
+                        stack.append(self._CELL)
+            elif kind is tuple:
+                if len(item) == 2 and type(item[0]) is int and type(item[1]) is int:
+                    buf.extend((ap, ap, cons, num, item[0], num, item[1]))
+                elif len(item) == 1:
+                    stack.append(item[0])
+                else:
+                    stack.append(item[-1])
+                    for x in reversed(item[:-1]):
+                        stack.append(x)
+                        stack.append(self._CELL)
+            elif isinstance(item, (list, tuple)):
+                stack.append(list(item) if isinstance(item, list) else tuple(item))
+            else:
+                buf.append(num)
+                buf.append(int(item))
+        return buf
+
     class _partial:
         def __init__(self, arg):
             self.arg = arg
         def __repr__(self):
             return f'Partial({repr(self.arg)})'
 
-    def decode_lists(self, data):
-        ap, cons, num, nil, gg = map(self.TOKENS.__getitem__, 'ap cons number nil GG'.split())
+    def decode_lists(self, data, start=0, memo=None):
+        # decodes one expression; REF tokens resolve through memo, keyed by ap offset
+        ap, cons, num, nil, gg, ref = map(self.TOKENS.__getitem__, 'ap cons number nil GG REF'.split())
+        memo = dict() if memo is None else memo
+        targets = self.ref_targets(data, start)
+        marks = list()
 
         def reduce(stack):
             while (stack[-3] == '$') and (stack[-2] != '$'):
@@ -77,20 +217,88 @@ class MachineImage:
                 else:
                     raise Exception((head, tail))
                 stack[-3:] = [xs]
+                if targets:
+                    mark = marks.pop()
+                    if mark in targets:
+                        memo[mark] = xs
+
+        def resolve(offset):
+            if offset in memo:
+                return memo[offset]
+            if (offset in marks) or (data[offset] != ap):
+                raise Exception(('bad reference', offset))
+            self.decode_lists(data, start=offset, memo=memo)
+            return memo[offset]
 
         stack = ['$', '$']
-        i = 0
-        while True:
+        i = start
+        while (len(stack) != 3) or (stack[-1] == '$'):
             # print('** ', i, repr(stack), '--', repr(data[i]))
             x = data[i]
             i += 1
             if x == gg: break
-            elif x == ap: stack.append('$')
+            elif x == ap:
+                if targets: marks.append(i - 1)
+                stack.append('$')
             elif x == nil: stack.append([]); reduce(stack)
             elif x == num: stack.append(data[i]); i += 1; reduce(stack)
+            elif x == ref: stack.append(resolve(data[i])); i += 1; reduce(stack)
             else: stack.append(x)
         return stack[-1]
 
+    def ref_targets(self, data, i=0):
+        ap, num, ref, gg = map(self.TOKENS.__getitem__, 'ap number REF GG'.split())
+        targets = set()
+        pending = 1
+        while pending:
+            x = data[i]
+            i += 1
+            if x == gg: break
+            elif x == ap: pending += 1
+            else:
+                pending -= 1
+                if x == num: i += 1
+                elif x == ref: targets.add(data[i]); i += 1
+        return targets
+
+    def skip_expr(self, data, i=0):
+        ap, num, ref = map(self.TOKENS.__getitem__, 'ap number REF'.split())
+        pending = 1
+        while pending:
+            x = data[i]
+            i += 1
+            if x == ap:
+                pending += 1
+            else:
+                pending -= 1
+                if (x == num) or (x == ref): i += 1
+        return i
+
+    def iter_list(self, data, i=0):
+        ap, cons, nil = map(self.TOKENS.__getitem__, 'ap cons nil'.split())
+        while data[i] == ap:
+            if (data[i + 1] != ap) or (data[i + 2] != cons):
+                raise Exception(('not a list', i))
+            i += 3
+            end = self.skip_expr(data, i)
+            yield i, end
+            i = end
+        if data[i] != nil:
+            raise Exception(('not a list', i))
+        return i + 1
+
+    def iter_images(self, data, start=None):
+        # galaxy result is [flag, state, images], or images alone at start;
+        # decode one layer at a time
+        memo = dict()
+        if start is None:
+            items = self.iter_list(data)
+            next(items)
+            next(items)
+            start, _ = next(items)
+        for i, _ in self.iter_list(data, start):
+            yield self.decode_lists(data, start=i, memo=memo)
+
     def run_tests(self):
         gg, = map(self.TOKENS.__getitem__, 'GG'.split())
         test_cases = [
@@ -106,57 +314,181 @@ class MachineImage:
             image += [gg]
             rev = MachineImage().decode_lists(image)
             assert rev == data, (rev, data)
+            call = MachineImage().encode_call('galaxy', data, data)
+            assert call.tolist() == MachineImage().emit_call('galaxy', data, data), (call, data)
+            image = MachineImage().encode_lists([data, data], share=True) + [gg]
+            rev = MachineImage().decode_lists(image)
+            assert rev == [data, data], (rev, data)
 
+        images = [[], [(1, 2), (-3, 4)], [(0, 0)]]
+        image = MachineImage().encode_lists([0, [1, [2, 3]], images]) + [gg]
+        rev = list(MachineImage().iter_images(image))
+        assert rev == images, (rev, images)
+        frame = FrameData(MachineImage().encode_lists(images))
+        assert list(frame) == images and list(frame) == images and frame, (frame, images)
+        assert not FrameData(MachineImage().encode_lists([]))
 
-class Galaxy:
-    def __init__(self, target='release', api_host=None, api_key=None):
-        self.state = []
+
+class LibGalaxy:
+    # ctypes binding to a cmake build of libgalaxy, e.g. the profile target;
+    # same calls as the arrival._galaxy extension
+    def __init__(self, target):
         fn = 'libgalaxy' + ('.dylib' if sys.platform == 'darwin' else '.so')
-        build_target = (target + '/') if target else ''
-        fn = next(Path(__file__).parent.resolve().parent.glob('**/' + build_target + fn))
-        print(repr(str(fn)))
-        self.galexy = ctypes.cdll.LoadLibrary(fn)
+        self.__file__ = str(Path(__file__).parent.resolve().parent / 'galaxy' / 'build' / target / fn)
+        self.lib = ctypes.cdll.LoadLibrary(self.__file__)
         p64 = ctypes.POINTER(ctypes.c_int64)
         u32 = ctypes.c_uint32
-        self.galexy.evaluate.argtypes = (u32, p64)
-        self.galexy.evaluate.restype = p64
-        self.galexy.load_machine.argtypes = (p64,)
-        self.galexy.load_machine.restype = None
-        self.space = SpaceClient(api_host=api_host, api_key=api_key)
+        self.lib.evaluate.argtypes = (u32, p64)
+        self.lib.evaluate.restype = p64
+        self.lib.load_machine.argtypes = (p64,)
+        self.lib.load_machine.restype = None
+        self.lib.galaxy_native_mode.argtypes = (u32,)
+        self.lib.galaxy_native_mode.restype = None
+        self.lib.modulate_expr.argtypes = (u32, p64)
+        self.lib.modulate_expr.restype = ctypes.c_char_p
+        self.lib.demodulate_to_image.argtypes = (ctypes.c_char_p, ctypes.POINTER(u32))
+        self.lib.demodulate_to_image.restype = p64
+        self.image = MachineImage()
+
+    def evaluate(self, state, event, raw_data=False, raw_images=False):
+        self.lib.load_machine(None)
+        image = self.image.encode_call('galaxy', state, event, share=True)
+        data = (ctypes.c_int64 * len(image)).from_buffer(image)
+        res = self.lib.evaluate(len(image), data)
+        del data
+        if raw_data or raw_images:
+            return self._decode_raw(res, raw_data, raw_images)
+        return MachineImage().decode_lists(res)
+
+    def _decode_raw(self, res, raw_data, raw_images):
+        # keep data or images as a machine image; flag is at ap ap cons [number flag]
+        m = MachineImage()
+        flag = m.decode_lists(res, start=3)
+        if not (raw_data if flag != 0 else raw_images):
+            return m.decode_lists(res)
+        (_, _), (state_at, _), (data_at, data_end) = m.iter_list(res)
+        if m.ref_targets(res, data_at):
+            flag, state, data = m.decode_lists(res)
+            return [flag, state, m.encode_lists(data)]
+        return [flag, m.decode_lists(res, start=state_at), res[data_at:data_end]]
+
+    def native_mode(self, mode):
+        self.lib.galaxy_native_mode(mode)
+
+    def modulate(self, image):
+        data = (ctypes.c_int64 * len(image))(*image)
+        return self.lib.modulate_expr(len(image), data)
+
+    def demodulate(self, text):
+        size = ctypes.c_uint32()
+        res = self.lib.demodulate_to_image(text, ctypes.byref(size))
+        if not res:
+            raise ValueError(('bad alien response', text))
+        return res[:size.value - 1]
+
+
+class Galaxy:
+    NATIVE_MODES = {'off': 0, 'on': 1, 'verify': 2}
+
+    def __init__(self, target=None, api_host=None, api_key=None, cache=None, alien=None, recorder=None, native='on', lazy_frames=False):
+        self.state = []
+        self.lazy_frames = lazy_frames
+        self.timings = []
+        self.image = MachineImage()
+        if target:
+            self.galexy = LibGalaxy(target)
+        else:
+            from . import _galaxy
+            self.galexy = _galaxy
+        print(repr(self.galexy.__file__))
+        self.cache = InteractionCache(cache, salt=Path(self.galexy.__file__).read_bytes()) if cache else None
+        self.galexy.native_mode(self.NATIVE_MODES[native])
+        if alien is None:
+            from .space import SpaceTransport
+            alien = ModulatingAlienProxy(SpaceTransport(api_host, api_key=api_key), self)
+        self.alien = alien
+        self.recorder = recorder
+        if recorder:
+            self.alien = recorder.wrap(self.alien)
+
+    def _interaction(self, state, event):
+        self.timings = list()
+        while True:
+            start = time.perf_counter()
+            flag, state, data = self._evaluate(state, event)
+            evaluated = time.perf_counter()
+            if (flag == 0):
+                self.timings.append((evaluated - start, 0))
+                return (state, data)
+            event = yield data
+            self.timings.append((evaluated - start, time.perf_counter() - evaluated))
 
     def _interact(self, state, event):
-        flag, state, data = self._evaluate(state, event)
-        if (flag == 0):
-            return (state, data)
-        return self._interact(state, self._send_to_alien(data))
+        steps = self._interaction(state, event)
+        try:
+            data = next(steps)
+            while True:
+                data = steps.send(self.alien.send(data))
+        except StopIteration as e:
+            return e.value
 
     def _evaluate(self, state, event):
-        self.galexy.load_machine(None)
-        image = MachineImage().emit_call('galaxy', state, event)
-        data = (ctypes.c_int64 * len(image))(*image)
-        res = self.galexy.evaluate(len(image), data)
-        res = MachineImage().decode_lists(res)
+        if self.cache:
+            # unshared image, so equal states hash the same whatever their object identity
+            key = self.cache.key(self.image.encode_call('galaxy', state, event))
+            if (cached := self.cache.get(key)) is not None:
+                return MachineImage().decode_lists(cached + [MachineImage.TOKENS['GG']])
+
+        res = self._evaluate_uncached(state, event)
         # print('<', repr(res))
+
+        if self.cache:
+            self.cache.put(key, MachineImage().encode_lists(res))
         return res
 
-    def _send_to_alien(self, data):
-        print('<~', repr(data))
-        res = self.space.send(data)
-        print('~>', repr(res))
+    def _evaluate_uncached(self, state, event):
+        modulated = getattr(self.alien, 'modulated', False)
+        res = self.galexy.evaluate(state, event, raw_data=modulated, raw_images=self.lazy_frames)
+        if modulated and res[0] != 0:
+            res[2] = MachineData(res[2])
+        elif self.lazy_frames and res[0] == 0:
+            res[2] = FrameData(res[2])
         return res
 
+    def close(self):
+        if self.cache:
+            self.cache.close()
+
+    def modulate(self, image):
+        return self.galexy.modulate(image)
+
+    def demodulate(self, text):
+        try:
+            return MachineData(self.galexy.demodulate(text))
+        except ValueError:
+            raise Exception(('bad alien response', text))
+
     def _render_frame(self, images):
         self.frame = images
 
-    def eval_step(self, mouse):
-        print('>', (self.state))
-        print('>', (mouse or (0, 0)))
-        (new_state, images) = self._interact(self.state, mouse or (0, 0))
+    def _step_done(self, new_state, images):
+        if self.recorder:
+            self.recorder.frame(new_state, images)
         print('<', (new_state))
         # print('<', (images))
+        if len(self.timings) > 1:
+            print('~', ' '.join(f'{e*1000:.1f}+{a*1000:.1f}ms' for e, a in self.timings))
         self.state = new_state
         self._render_frame(images)
 
+    def eval_step(self, mouse):
+        print('>', (self.state))
+        print('>', (mouse or (0, 0)))
+        if self.recorder:
+            self.recorder.step(self.state, mouse or (0, 0))
+        (new_state, images) = self._interact(self.state, mouse or (0, 0))
+        self._step_done(new_state, images)
+
 
 if __name__ == '__main__':
     g = Galaxy()
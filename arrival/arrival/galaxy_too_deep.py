@@ -1,8 +1,10 @@
 import io
 import sys
 from collections import deque
-from conscodec import ConsCodec
 from pathlib import Path
+from .cache import InteractionCache
+from .conscodec import ConsCodec
+from .galaxy import MachineImage
 
 
 def PARSE_NUMBER(s):
@@ -14,6 +16,11 @@ def PARSE_NUMBER(s):
 
 
 def PARSE_FUNCTIONS(fn):
+    with open(fn) as fp:
+        return PARSE_PROGRAM(fp.read())
+
+
+def PARSE_PROGRAM(text):
     def parse_ast(tokens):
         stream = iter(tokens)
         def read(): return next(stream, None)
@@ -30,12 +37,11 @@ def PARSE_FUNCTIONS(fn):
         return stack[-1]
 
     scope = dict()
-    with open(fn) as fp:
-        for s in fp.readlines():
-            tokens = s.split()
-            if tokens:
-                assert tokens[1] == '='
-                scope[tokens[0]] = parse_ast(tokens[2:])
+    for s in text.splitlines():
+        tokens = s.split()
+        if tokens:
+            assert tokens[1] == '='
+            scope[tokens[0]] = parse_ast(tokens[2:])
     return scope
 
 
@@ -189,21 +195,41 @@ nil = Atom("nil")
 
 
 class Galaxy:
-    def __init__(self, target=None):
+    def __init__(self, target=None, cache=None, alien=None):
         fn = next(Path(__file__).parent.resolve().glob('../../**/spec/galaxy.txt'))
         self.functions = PARSE_FUNCTIONS(fn)
         self.state = nil
         self.mouse = (0, 0)
         self.frame = None
+        self.cache = InteractionCache(cache, salt=fn.read_bytes()) if cache else None
+        self.alien = alien
+        self.reductions = 0
 
     def interact(self, state, event):
+        flag, newState, data = self._evaluate(state, event)
+        if (self._asNum(flag) == 0):
+            return (newState, data)
+        return self.interact(newState, self._send_to_alien(data))
+
+    def _send_to_alien(self, data):
+        if self.alien is None:
+            return SEND_TO_ALIEN_PROXY(data)
+        return list_to_cons(self.alien.send(cons_to_list(data)))
+
+    def _evaluate(self, state, event):
+        if self.cache:
+            key = self.cache.key(MachineImage().emit_call('galaxy', cons_to_list(state), cons_to_list(event)))
+            if (cached := self.cache.get(key)) is not None:
+                res = MachineImage().decode_lists(cached + [MachineImage.TOKENS['GG']])
+                return GET_LIST_ITEMS_FROM_EXPR(list_to_cons(res))
+
         expr = Ap(Ap(Atom("galaxy"), state), event)
         res = self._eval1(expr)
         # Note: res will be modulatable here (consists of cons, nil and numbers only)
-        flag, newState, data = GET_LIST_ITEMS_FROM_EXPR(res)
-        if (self._asNum(flag) == 0):
-            return (newState, data)
-        return self.interact(newState, SEND_TO_ALIEN_PROXY(data))
+
+        if self.cache:
+            self.cache.put(key, MachineImage().encode_lists(cons_to_list(res)))
+        return GET_LIST_ITEMS_FROM_EXPR(res)
 
     def _eval1(self, expr):
         if (expr.evaluated is not None):
@@ -214,6 +240,7 @@ class Galaxy:
             if (result == expr):
                 initialExpr.evaluated = result
                 return result
+            self.reductions += 1
             expr = result
 
     def _tryEval(self, expr):
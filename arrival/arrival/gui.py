@@ -1,10 +1,16 @@
 from decoder import ocr_image
-from galaxy import Galaxy
+from galaxy import BOOT_SEQUENCE, Galaxy
+from session import SessionRecorder
+import multiprocessing
 import numpy as np
+import os
+import queue
 import random
 import sys
 import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from PySide2.QtWidgets import (QApplication, QDialog, QLineEdit, QLabel, QPushButton, QVBoxLayout,
     QGraphicsScene, QGraphicsView, QInputDialog)
 from PySide2.QtCore import QObject, Qt, QRunnable, QThreadPool, Signal, Slot
@@ -25,6 +31,9 @@ with open(Path(__file__).parent / '../../.env') as fp:
     obj = yaml.safe_load(fp)
     API_KEY = obj['api_key']
 
+CACHE_FILE = Path(__file__).parent / '../../.galaxy-cache.sqlite'
+SESSION_DIR = Path(__file__).parent / '../../sessions'
+
 
 class WorkerSignals(QObject):
     finished = Signal()
@@ -37,10 +46,7 @@ class Worker(QRunnable):
     def __init__(self, fn, *args, **kwargs):
         super().__init__()
         self.cancelled = False
-        self.mouse_click = None
-        self.redraw = None
-        self.set_state = None
-        self.ocr = None
+        self.events = queue.Queue()
         self.fn = fn
         self.args = args
         self.kwargs = kwargs
@@ -62,13 +68,31 @@ class Worker(QRunnable):
             if self.signals:
                 self.signals.finished.emit()
 
+    def post(self, kind, arg=None):
+        self.events.put((kind, arg, time.perf_counter()))
+
+    def cancel(self):
+        self.cancelled = True
+        self.events.put(None)
+
+    def next_events(self):
+        events = [self.events.get()]
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return [e for e in events if e is not None]
 
-def render_frame(data, scale):
-    if len(data) != 1: print('layers', len(data))
-    canvas = np.zeros((*WorldSize[::-1], 4), dtype=np.float)
 
-    canvas = Image.fromarray(canvas, mode='RGBA')
-    palette = np.array([
+def _hsv_palette(hsv):
+    px = (np.array([hsv]) * 255).astype(np.uint8)
+    rgb = np.array(Image.fromarray(px, mode='HSV').convert('RGB'))[0]
+    return np.vstack([[0, 0, 0], rgb]).astype(np.uint8)
+
+
+class FrameRenderer:
+    palette = _hsv_palette([
         [0.0, 0.0, 0.2],
         [0.0, 0.0, 0.4],
         [0.0, 0.0, 0.6],
@@ -78,96 +102,220 @@ def render_frame(data, scale):
         [0.4, 0.5, 0.8],
         [0.6, 0.5, 0.8],
         [0.8, 0.5, 0.8],
-    ], dtype=np.float)
+    ])
+
+    def __init__(self, size=WorldSize):
+        self.size = size
+        self.layers = list()
+        self.composite = None
+        self.image = None
+        self.scale = None
+
+    def _layer(self, pts):
+        mask = np.zeros(self.size[::-1], dtype=bool)
+        if pts:
+            WorldCenter = (self.size[0] // 2, self.size[1] // 2)
+            pts = np.array(pts, dtype=np.int32) + np.array(WorldCenter, dtype=np.int32)
+            mask[pts[:,1], pts[:,0]] = True
+        return mask
+
+    def _update_layers(self, data):
+        # single pass, so layers may be streamed while they are decoded
+        layers = list()
+        changed = False
+        for i, pts in enumerate(data):
+            key = hash(tuple(pts))
+            if (i < len(self.layers)) and (self.layers[i][0] == key):
+                layers.append(self.layers[i])
+            else:
+                layers.append((key, self._layer(pts)))
+                changed = True
+        changed = changed or (len(layers) != len(self.layers))
+        self.layers = layers
+        return changed
 
-    WorldCenter = (WorldSize[0] // 2, WorldSize[1] // 2)
-    offset = np.array(WorldCenter, dtype=np.uint32)
-    for i, pts in enumerate(reversed(data)):
-        if not pts: continue
-        pts = np.array(pts, dtype=np.int32)
-        pts += offset
-        layer = np.zeros((*WorldSize[::-1], 3), dtype=np.float)
-        layer[pts[:,1], pts[:,0], :] = palette[i]
+    def render(self, data, scale):
+        changed = self._update_layers(data)
+        if len(self.layers) != 1: print('layers', len(self.layers))
+        if changed or (self.composite is None):
+            index = np.zeros(self.size[::-1], dtype=np.uint8)
+            for i, (_, mask) in enumerate(reversed(self.layers)):
+                index[mask] = min(i + 1, len(self.palette) - 1)
+            self.composite = Image.fromarray(self.palette[index], mode='RGB')
+            self.image = None
 
-        layer = Image.fromarray((layer * 255).astype(np.uint8), mode='HSV').convert('RGBA')
-        mask = np.zeros(WorldSize[::-1], dtype=np.float)
-        mask[pts[:,1], pts[:,0]] = 1
-        mask = Image.fromarray((mask * 255).astype(np.uint8), mode='L')
-        canvas.paste(layer, mask=mask)
+        if (self.image is None) or (self.scale != scale):
+            CanvasSize = (self.size[0] * scale, self.size[1] * scale)
+            self.image = self.composite.resize(CanvasSize, Image.NEAREST)
+            self.scale = scale
+        return self.image
 
-    CanvasSize = (WorldSize[0] * scale, WorldSize[1] * scale)
-    im = canvas.convert('RGB').resize(CanvasSize, Image.NEAREST)
-    return im
 
+_Renderer = FrameRenderer()
 
-last_frame_data = None
 
+def render_frame(data, scale):
+    return _Renderer.render(data, scale)
 
-def execute_this_fn(worker, *args, **kwargs):
-    progress_signal = kwargs['progress_callback']
 
-    galaxy = Galaxy(target='release', api_host=API_HOST, api_key=API_KEY)
+_SpeculationGalaxy = None
+
+
+def _speculation_init():
+    global _SpeculationGalaxy
+    _SpeculationGalaxy = Galaxy(lazy_frames=True)
+
+
+def _speculate(state, event):
+    return _SpeculationGalaxy._evaluate(state, event)
+
+
+class Speculator:
+    def __init__(self, limit=256, candidates=32):
+        self.limit = limit
+        self.candidates = candidates
+        self.cache = OrderedDict()
+        workers = max(1, (os.cpu_count() or 2) - 1)
+        context = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_speculation_init)
+
+    def _key(self, state, event):
+        return repr((state, event))
+
+    def _points(self, frame):
+        seen = set()
+        points = list()
+        for layer in frame:
+            for p in layer:
+                if p not in seen:
+                    seen.add(p)
+                    points.append(p)
+        stride = max(1, len(points) // self.candidates)
+        return points[::stride][:self.candidates]
+
+    def speculate(self, state, frame):
+        for key, future in list(self.cache.items()):
+            if future.cancel():
+                del self.cache[key]
+
+        for x, y in self._points(frame):
+            event = (int(x), int(y))
+            key = self._key(state, event)
+            if key in self.cache:
+                continue
+            self.cache[key] = self.pool.submit(_speculate, state, event)
+
+        while len(self.cache) > self.limit:
+            _, future = self.cache.popitem(last=False)
+            future.cancel()
+
+    def take(self, state, event):
+        future = self.cache.pop(self._key(state, event), None)
+        if (future is None) or future.cancelled():
+            return
+        try:
+            return future.result()
+        except Exception:
+            traceback.print_exc()
+
+    def clear(self):
+        for future in self.cache.values():
+            future.cancel()
+        self.cache.clear()
+
+    def shutdown(self):
+        self.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class SpeculativeGalaxy (Galaxy):
+    def __init__(self, speculator, **kwargs):
+        super().__init__(**kwargs)
+        self.speculator = speculator
+
+    def _evaluate_uncached(self, state, event):
+        if (res := self.speculator.take(state, event)) is not None:
+            print('speculation hit', repr(event))
+            return res
+        return super()._evaluate_uncached(state, event)
+
+
+def _coalesce_clicks(events):
+    # a new state discards the clicks queued against the previous one
+    for i in reversed(range(len(events))):
+        if events[i][0] == 'state':
+            return [e for e in events[:i] if e[0] != 'click'] + events[i:]
+    return events
+
+
+def execute_this_fn(worker, renderer, *args, **kwargs):
+    SESSION_DIR.mkdir(exist_ok=True)
+    recorder = SessionRecorder(SESSION_DIR / time.strftime('%Y%m%d-%H%M%S.trace'))
+    speculator = Speculator()
+    galaxy = SpeculativeGalaxy(speculator, api_host=API_HOST, api_key=API_KEY, cache=CACHE_FILE,
+        recorder=recorder, lazy_frames=True)
 
     def galaxy_eval(mouse):
-        global last_frame_data
         if mouse[0] < -100:
             mouse = (mouse[0] + WorldSize[0], mouse[1])
-        galaxy.eval_step(mouse)
+        galaxy.eval_step((int(mouse[0]), int(mouse[1])))
         frame_data = galaxy.frame
         if frame_data:
             galaxy.frame = None
-            last_frame_data = frame_data
-            im = render_frame(frame_data, scale=WorldScale)
-            progress_signal.emit(im)
+            renderer.post('frame', frame_data)
+        return frame_data
 
-    boot_sequence = [
-        (0, 0),
-        (0, 0),
-        (0, 0),
-        (0, 0),
-        (0, 0),
-        (0, 0),
-        (0, 0),
-        (0, 0),
-        (8, 4),
-        (2, -8),
-        (3, 6),
-        (0, -14),
-        (-4, 10),
-        (9, -3),
-        (-4, 10),
-        (1, 4),
-    ]
-    for mouse in boot_sequence:
-        galaxy_eval(mouse)
+    frame_data = None
+    for mouse in BOOT_SEQUENCE:
+        frame_data = galaxy_eval(mouse) or frame_data
 
     while not worker.cancelled:
-        if worker.set_state:
-            state = worker.set_state
-            worker.set_state = None
-            if state:
-                galaxy.state = state
-
-        if worker.ocr:
-            worker.ocr = None
-            im = render_frame(last_frame_data, scale=1)
-            for symbol, box in ocr_image(im):
-                print('  ', repr(symbol), repr(box))
+        if frame_data and worker.events.empty():
+            speculator.speculate(galaxy.state, frame_data)
+
+        for kind, arg, posted in _coalesce_clicks(worker.next_events()):
+            if worker.cancelled:
+                break
 
-        if worker.redraw:
-            worker.redraw = None
-            if last_frame_data:
-                im = render_frame(last_frame_data, scale=WorldScale)
-                progress_signal.emit(im)
+            if kind == 'state':
+                if arg:
+                    galaxy.state = arg
+                    speculator.clear()
+                    frame_data = None
 
-        mouse = worker.mouse_click
-        if not mouse:
-            time.sleep(0.1)
+            elif kind == 'click':
+                latency = (time.perf_counter() - posted) * 1000
+                print('mouse', arg, f'latency {latency:.1f} ms')
+                frame_data = galaxy_eval(arg) or frame_data
+
+    speculator.shutdown()
+    galaxy.close()
+    recorder.close()
+
+
+def render_this_fn(worker, *args, **kwargs):
+    progress_signal = kwargs['progress_callback']
+    frame_data = None
+
+    while not worker.cancelled:
+        events = worker.next_events()
+        kinds = set()
+        for kind, arg, _ in events:
+            kinds.add(kind)
+            if kind == 'frame':
+                frame_data = arg
+
+        if not frame_data:
             continue
 
-        worker.mouse_click = None
-        print('mouse', mouse)
-        galaxy_eval(mouse)
+        if 'ocr' in kinds:
+            im = render_frame(frame_data, scale=1)
+            for symbol, box in ocr_image(im):
+                print('  ', repr(symbol), repr(box))
+
+        if kinds & {'frame', 'redraw', 'ocr'}:
+            im = render_frame(frame_data, scale=WorldScale)
+            progress_signal.emit(im)
 
 
 def progress_fn(im):
@@ -201,20 +349,26 @@ class AppView (QGraphicsView):
         global _Scene
         _Scene = self.gscene
 
-        worker = Worker(execute_this_fn)
+        renderer = Worker(render_this_fn)
+        renderer.signals.finished.connect(thread_complete)
+        renderer.signals.progress.connect(progress_fn)
+        self.renderer = renderer
+
+        worker = Worker(execute_this_fn, renderer)
         worker.signals.result.connect(print_output)
         worker.signals.finished.connect(thread_complete)
-        worker.signals.progress.connect(progress_fn)
         self.worker = worker
 
         self.threadpool = QThreadPool()
+        self.threadpool.setMaxThreadCount(max(2, self.threadpool.maxThreadCount()))
+        self.threadpool.start(renderer)
         self.threadpool.start(worker)
 
     def mousePressEvent(self, event):
         p = self.mapToScene(event.pos())
         WorldCenter = (WorldSize[0] // 2, WorldSize[1] // 2)
         mouse = (p.x() // WorldScale - WorldCenter[0], p.y() // WorldScale - WorldCenter[1])
-        self.worker.mouse_click = mouse
+        self.worker.post('click', mouse)
 
     def keyPressEvent(self, event):
         ctrl = (event.modifiers() == Qt.ControlModifier) or (event.modifiers() == (Qt.ControlModifier | Qt.ShiftModifier))
@@ -235,23 +389,23 @@ class AppView (QGraphicsView):
         WorldScale += 1
         if WorldScale > 14:
             WorldScale = int(WorldScale * 1.1)
-        self.worker.redraw = True
+        self.renderer.post('redraw')
 
     def zoom_out(self):
         global WorldScale
         if WorldScale > 14:
             WorldScale = int(WorldScale / 1.1)
         WorldScale = max(1, WorldScale - 1)
-        self.worker.redraw = True
+        self.renderer.post('redraw')
 
     def input_state(self):
         text, ok = QInputDialog().getText(self, "Enter state", "State:", QLineEdit.Normal, '[2, [1, -1], 0, []]')
         if ok and text:
-            self.worker.set_state = eval(text)
-            self.worker.mouse_click = (-1000, -1000)
+            self.worker.post('state', eval(text))
+            self.worker.post('click', (-1000, -1000))
 
     def ocr(self):
-        self.worker.ocr = True
+        self.renderer.post('ocr')
 
 
 def galaxy_gui(argv=[]):
@@ -261,7 +415,8 @@ def galaxy_gui(argv=[]):
     view.resize(*CanvasSize)
     view.show()
     r = app.exec_()
-    view.worker.cancelled = True
+    view.worker.cancel()
+    view.renderer.cancel()
     return r
 
 
@@ -0,0 +1,189 @@
+import gzip
+import random
+import struct
+import sys
+import threading
+import time
+from array import array
+from .galaxy import BOOT_SEQUENCE, Galaxy, LocalAlienProxy, MachineImage
+
+
+STEP, ALIEN_REQUEST, ALIEN_RESPONSE, FRAME = range(1, 5)
+
+_Header = struct.Struct('<BI')
+
+
+class SessionRecorder:
+    def __init__(self, fn):
+        self.fp = gzip.open(fn, 'wb')
+
+    def write(self, kind, data):
+        body = array('q', MachineImage().encode_lists(data))
+        self.fp.write(_Header.pack(kind, len(body)))
+        self.fp.write(body.tobytes())
+
+    def step(self, state, event):
+        self.write(STEP, [state, event])
+
+    def frame(self, state, images):
+        self.write(FRAME, [state, images])
+        self.fp.flush()
+
+    def wrap(self, alien):
+        return RecordingAlienProxy(alien, self)
+
+    def close(self):
+        self.fp.close()
+
+
+class RecordingAlienProxy:
+    def __init__(self, proxy, recorder):
+        self.proxy = proxy
+        self.recorder = recorder
+
+    @property
+    def modulated(self):
+        # machine data passes through, the recorder splices it into the trace
+        return getattr(self.proxy, 'modulated', False)
+
+    def send(self, data):
+        self.recorder.write(ALIEN_REQUEST, data)
+        res = self.proxy.send(data)
+        self.recorder.write(ALIEN_RESPONSE, res)
+        return res
+
+
+def read_session(fn):
+    gg = MachineImage.TOKENS['GG']
+    with gzip.open(fn, 'rb') as fp:
+        while (header := fp.read(_Header.size)):
+            kind, size = _Header.unpack(header)
+            body = array('q')
+            body.frombytes(fp.read(size * body.itemsize))
+            yield kind, MachineImage().decode_lists(body.tolist() + [gg])
+
+
+class Step:
+    def __init__(self, state, event):
+        self.state = state
+        self.event = event
+        self.responses = list()
+        self.new_state = None
+        self.images = None
+
+
+def load_steps(fn):
+    steps = list()
+    for kind, data in read_session(fn):
+        if kind == STEP:
+            steps.append(Step(*data))
+        elif kind == ALIEN_RESPONSE:
+            steps[-1].responses.append(data)
+        elif kind == FRAME:
+            steps[-1].new_state, steps[-1].images = data
+    return steps
+
+
+class NativeEvaluator:
+    name = 'libgalaxy'
+
+    def __init__(self, native='on'):
+        self.galaxy = Galaxy(native=native)
+
+    def step(self, state, event, responses):
+        self.galaxy.alien = LocalAlienProxy(responses)
+        return self.galaxy._interact(state, event)
+
+
+class PythonEvaluator:
+    name = 'galaxy_too_deep'
+
+    def __init__(self, native=None):
+        from . import galaxy_too_deep
+        self.module = galaxy_too_deep
+        self.galaxy = galaxy_too_deep.Galaxy()
+
+    def step(self, state, event, responses):
+        m = self.module
+        self.galaxy.alien = LocalAlienProxy(responses)
+        new_state, images = self.galaxy.interact(m.list_to_cons(state), m.list_to_cons(event))
+        return m.cons_to_list(new_state), m.cons_to_list(images)
+
+
+Evaluators = {
+    'native': NativeEvaluator,
+    'python': PythonEvaluator,
+}
+
+
+def _percentile(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+
+def replay(steps, evaluator):
+    same = lambda a, b: MachineImage().encode_lists(a) == MachineImage().encode_lists(b)
+    timings = list()
+    mismatches = 0
+    for i, step in enumerate(steps):
+        start = time.perf_counter()
+        new_state, images = evaluator.step(step.state, step.event, step.responses)
+        timings.append(time.perf_counter() - start)
+        if not (same(new_state, step.new_state) and same(images, step.images)):
+            print(f'step {i}: result differs from recording', file=sys.stderr)
+            mismatches += 1
+    return timings, mismatches
+
+
+def record(fn, clicks=200, seed=0, api_host=None, api_key=None):
+    rng = random.Random(seed)
+    recorder = SessionRecorder(fn)
+    galaxy = Galaxy(api_host=api_host, api_key=api_key, recorder=recorder)
+    try:
+        for mouse in BOOT_SEQUENCE:
+            galaxy.eval_step(mouse)
+        for _ in range(clicks):
+            points = [p for layer in (galaxy.frame or []) for p in layer]
+            mouse = rng.choice(points) if points else (0, 0)
+            galaxy.eval_step(mouse)
+    finally:
+        recorder.close()
+
+
+def report(fn, engines, limit=None, native='on'):
+    steps = load_steps(fn)[:limit]
+    print(f'{len(steps)} steps from {fn}')
+    for name in engines:
+        evaluator = Evaluators[name](native=native)
+        timings, mismatches = replay(steps, evaluator)
+        total = sum(timings)
+        p50 = _percentile(timings, 0.50) * 1000
+        p99 = _percentile(timings, 0.99) * 1000
+        print(f'{evaluator.name:>16}: total {total:.3f}s  p50 {p50:.2f}ms  p99 {p99:.2f}ms  mismatches {mismatches}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    def main(command, trace, clicks=200, seed=0, engines=None, limit=None, native='on'):
+        if command == 'record':
+            record(trace, clicks=clicks, seed=seed)
+        elif command == 'replay':
+            # the reference evaluator recurses deeply
+            sys.setrecursionlimit(1000000)
+            threading.stack_size(0x10000000)
+            t = threading.Thread(target=report, args=(trace, engines or ['native', 'python']), kwargs=dict(limit=limit, native=native))
+            t.start()
+            t.join()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['record', 'replay'])
+    parser.add_argument('trace', help='Session trace file')
+    parser.add_argument('-n', '--clicks', type=int, default=200, help='Random clicks to record after boot')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-e', '--engine', action='append', choices=list(Evaluators), help='Evaluators to replay with, default native and python')
+    parser.add_argument('-l', '--limit', type=int, help='Replay only first steps')
+    parser.add_argument('--native', choices=list(Galaxy.NATIVE_MODES), default='on', help='Native galaxy function overrides in libgalaxy')
+    args = parser.parse_args()
+
+    main(args.command, args.trace, clicks=args.clicks, seed=args.seed, engines=args.engine, limit=args.limit, native=args.native)
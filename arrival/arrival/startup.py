@@ -0,0 +1,47 @@
+import subprocess
+import sys
+
+
+# each probe runs in a fresh interpreter, timing only the arrival imports
+PROBES = {
+    'ConsCodec': 'import arrival; arrival.ConsCodec()',
+    'MachineImage': 'import arrival; arrival.MachineImage()',
+    'Parser': 'import arrival; arrival.Parser()',
+    'SpaceClient': 'import arrival; arrival.SpaceClient',
+    'ocr': 'import arrival; arrival.ocr',
+    'eager': 'import arrival; [getattr(arrival, name) for name in arrival.__all__]',
+}
+
+_Timer = '''import time
+start = time.perf_counter()
+{}
+print(time.perf_counter() - start)
+'''
+
+
+def measure(code, runs=10):
+    timings = list()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', _Timer.format(code)], capture_output=True, text=True, check=True).stdout
+        timings.append(float(out))
+    return sorted(timings)
+
+
+def report(probes, runs=10):
+    for name in probes:
+        timings = measure(PROBES[name], runs=runs)
+        best = timings[0] * 1000
+        median = timings[len(timings) // 2] * 1000
+        print(f'{name:>16}: best {best:.2f}ms  median {median:.2f}ms')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('probe', nargs='*', help='Import probes to time, default all: ' + ', '.join(PROBES))
+    parser.add_argument('-n', '--runs', type=int, default=10, help='Fresh interpreters per probe')
+    args = parser.parse_args()
+    if unknown := set(args.probe) - set(PROBES):
+        parser.error(f'unknown probe: {", ".join(sorted(unknown))}')
+
+    report(args.probe or list(PROBES), runs=args.runs)
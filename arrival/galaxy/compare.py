@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from arrival import MachineImage
+from test import preprocess
+
+
+class Case:
+    def __init__(self, fn):
+        self.name = Path(fn).name
+        self.code = Path(fn).read_text().split('---')[0]
+        self.machine, params, self.expect = preprocess(fn)
+        self.params = params if isinstance(params, tuple) else (params,)
+
+
+class NativeEngine:
+    name = 'libgalaxy'
+
+    def __init__(self):
+        from arrival import _galaxy
+        from arrival.session import NativeEvaluator
+        self.lib = _galaxy
+        self.session = NativeEvaluator()
+
+    def reductions(self):
+        return self.lib.eval_stats()[0]
+
+    def case(self, case):
+        self.lib.load_machine(case.machine)
+        image = self.lib.evaluate_image(MachineImage().emit_call('galaxy', *case.params))
+        return MachineImage().decode_lists(image + [MachineImage.TOKENS['GG']])
+
+    def step(self, step):
+        return list(self.session.step(step.state, step.event, step.responses))
+
+
+class PythonEngine:
+    name = 'galaxy_too_deep'
+
+    def __init__(self):
+        from arrival import galaxy_too_deep
+        from arrival.session import PythonEvaluator
+        self.module = galaxy_too_deep
+        self.session = PythonEvaluator()
+        self.galaxy = galaxy_too_deep.Galaxy()
+
+    def reductions(self):
+        return self.galaxy.reductions + self.session.galaxy.reductions
+
+    def case(self, case):
+        m = self.module
+        self.galaxy.functions = m.PARSE_PROGRAM(case.code)
+        expr = m.Atom('galaxy')
+        for x in case.params:
+            expr = m.Ap(expr, m.list_to_cons(x))
+        return m.cons_to_list(self.galaxy._eval1(expr))
+
+    def step(self, step):
+        return list(self.session.step(step.state, step.event, step.responses))
+
+
+class ParserEngine:
+    # the parser.py rewriter; reduces node trees in passes, spec cases only
+    name = 'parser'
+
+    def __init__(self):
+        from arrival import parser
+        self.module = parser
+        self.passes = 0
+
+    def reductions(self):
+        return self.passes
+
+    def value(self, node):
+        m = self.module
+        if isinstance(node, m.IntValue):
+            return node.value(None)
+        if isinstance(node, m.NilValue):
+            return []
+        if isinstance(node, m.List):
+            return [self.value(x) for x in node]
+        if isinstance(node, m.Cons):
+            return tuple(self.value(x) for x in node.value(None))
+        raise Exception(('not reduced to a value', node))
+
+    def literal(self, x):
+        m = self.module
+        if isinstance(x, list):
+            return m.List(*map(self.literal, x))
+        if isinstance(x, tuple):
+            return m.Cons(*map(self.literal, x))
+        return m.IntValue(x)
+
+    def case(self, case, max_passes=10000):
+        m = self.module
+        scope = m.Parser().parse_program(case.code)
+        node = m.NameRef('galaxy')
+        for x in case.params:
+            node = m.Apply(node, self.literal(x))
+        for _ in range(max_passes):
+            if (r := node.reduce(scope, set())) is None:
+                break
+            self.passes += 1
+            node = r
+        return self.value(node)
+
+    def step(self, step):
+        return None
+
+
+Engines = {
+    'native': NativeEngine,
+    'python': PythonEngine,
+    'parser': ParserEngine,
+}
+
+
+def _encode(value):
+    return MachineImage().encode_lists(value)
+
+
+def _run(engine_name, suite, items):
+    engine = Engines[engine_name]()
+    run = engine.case if suite == 'spec' else engine.step
+    results = list()
+    elapsed = 0
+    reductions = engine.reductions()
+    for item in items:
+        start = time.perf_counter()
+        try:
+            res = run(item)
+            res = None if res is None else _encode(res)
+        except Exception as e:
+            res = ('error', repr(e)[:200])
+        elapsed += time.perf_counter() - start
+        results.append(res)
+    reductions = engine.reductions() - reductions
+    # kilobytes on linux, bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return results, elapsed, reductions, peak
+
+
+def run_engine(engine_name, suite, items):
+    # the reference evaluators recurse deeply
+    sys.setrecursionlimit(1000000)
+    threading.stack_size(0x10000000)
+    out = list()
+    t = threading.Thread(target=lambda: out.append(_run(engine_name, suite, items)))
+    t.start()
+    t.join()
+    return out[0]
+
+
+def load_suites(cases_dir, traces, limit=None):
+    from arrival.session import load_steps
+    suites = list()
+    if cases_dir:
+        cases = [Case(fn) for fn in sorted(Path(cases_dir).glob('*.txt'))]
+        suites.append(('spec', 'spec', cases, [_encode(c.expect) for c in cases], [c.name for c in cases]))
+    for fn in traces:
+        steps = load_steps(fn)[:limit]
+        expected = [_encode([s.new_state, s.images]) for s in steps]
+        suites.append((Path(fn).name, 'session', steps, expected, [f'step {i}' for i in range(len(steps))]))
+    return suites
+
+
+def compare(suites, engines, fp=sys.stdout):
+    print(f'{"suite":>16} {"engine":>16} {"items":>6} {"agree":>6} {"time":>10} {"reductions":>12} {"peak rss":>10}', file=fp)
+    failures = 0
+    for title, suite, items, expected, names in suites:
+        answers = dict()
+        for name in engines:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                results, elapsed, reductions, peak = pool.submit(run_engine, name, suite, items).result()
+            if all(r is None for r in results):
+                print(f'{title:>16} {Engines[name].name:>16} {"n/a":>6}', file=fp)
+                continue
+            agree = sum(r == x for r, x in zip(results, expected))
+            failures += len(results) - agree
+            answers[name] = results
+            print(f'{title:>16} {Engines[name].name:>16} {len(results):>6} {agree:>6} {elapsed:>9.3f}s {reductions:>12} {peak / 2**20:>8.1f}MB', file=fp)
+
+        for i, x in enumerate(expected):
+            wrong = [Engines[name].name for name, results in answers.items() if results[i] != x]
+            if wrong:
+                print(f'{title}: {names[i]}: differs in {", ".join(wrong)}', file=sys.stderr)
+    return failures
+
+
+def main(cases_dir=None, traces=None, engines=None, limit=None):
+    suites = load_suites(cases_dir, traces or [], limit=limit)
+    failures = compare(suites, engines or ['native', 'python'])
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run spec cases and recorded sessions through galaxy evaluators and compare')
+    parser.add_argument('trace', nargs='*', help='Session trace files')
+    parser.add_argument('-d', '--cases', metavar='DIR', default=str(Path(__file__).parent / '../../spec/tests'), help='Spec test cases')
+    parser.add_argument('--no-cases', action='store_true', help='Skip spec test cases')
+    parser.add_argument('-e', '--engine', action='append', choices=list(Engines), help='Evaluators to compare, default native and python')
+    parser.add_argument('-l', '--limit', type=int, help='Replay only first steps of each trace')
+    args = parser.parse_args()
+
+    sys.exit(main(
+        cases_dir=None if args.no_cases else args.cases,
+        traces=args.trace,
+        engines=args.engine,
+        limit=args.limit,
+    ))
@@ -1,7 +1,13 @@
 #include <cinttypes>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
 #include <map>
 #include <memory>
 #include <set>
+#include <string>
+#include <unordered_map>
+#include <vector>
 
 #include "galaxy_machine.inc"
 
@@ -16,6 +22,11 @@ typedef uint64_t u64;
 extern "C" {
     const void load_machine(const i64* image);
     const i64* evaluate(u32 size, const i64* request);
+    const i64* galaxy_profile(u32* size);
+    const void galaxy_profile_reset();
+    const void galaxy_native_mode(u32 mode);
+    const char* modulate_expr(u32 size, const i64* image);
+    const i64* demodulate_to_image(const char* text, u32* size);
 }
 
 
@@ -26,53 +37,129 @@ fatal_error() {
 
 typedef struct expr {
     atom_kind kind;
+    // rom: allocated by load_machine, outlives the per-call arena
+    // trailed: original contents saved in rom_trail for this call
+    u8 rom;
+    u8 trailed;
     expr* l;
     expr* r;
     i64 number;
     expr* evaluated;
+#ifdef GALAXY_PROFILE
+    // :NNNN of the definition that created the node, -1 for input images
+    i64 origin;
+#endif
 } expr;
 
 
-typedef struct node {
-    node* parent;
-    expr* e;
-} node;
+// explicit stacks are growable vectors, kept between calls
+typedef std::vector<expr*> expr_stack;
+
+
+static expr*
+stack_at(const expr_stack& stack, u32 depth) {
+    return stack[stack.size() - 1 - depth];
+}
+
 
+// open addressing map from nodes to image offsets; only used slots are
+// cleared between calls
+typedef struct offset_table {
+    std::vector<expr*> keys;
+    std::vector<i64> offsets;
+    std::vector<u64> used;
+} offset_table;
 
-static node*
-make_node(expr* e = nullptr, node* parent = nullptr) {
-    node* n = (node*) calloc(1, sizeof(node));
-    n->parent = parent;
-    n->e = e;
-    return n;
+
+static u64
+offset_table_slot(const offset_table& table, expr* key) {
+    u64 mask = table.keys.size() - 1;
+    u64 h = u64(uintptr_t(key)) * 0x9e3779b97f4a7c15ull;
+    u64 i = (h ^ (h >> 32)) & mask;
+    for (; table.keys[i] != nullptr && table.keys[i] != key; i = (i + 1) & mask) {
+    }
+    return i;
 }
 
 
 static void
-free_node(node* n) {
-    while (n != nullptr) {
-        node* p = n->parent;
-        free(n);
-        n = p;
+offset_table_clear(offset_table& table) {
+    if (table.keys.empty()) {
+        table.keys.assign(1024, nullptr);
+        table.offsets.assign(1024, 0);
     }
+    for (u64 i : table.used) {
+        table.keys[i] = nullptr;
+    }
+    table.used.clear();
 }
 
 
-static node*
-stack_push(node* stack, expr* e) {
-    return make_node(e, stack);
+static void
+offset_table_insert(offset_table& table, expr* key, i64 offset);
+
+
+static void
+offset_table_grow(offset_table& table) {
+    std::vector<expr*> keys(table.keys.size() * 2, nullptr);
+    std::vector<i64> offsets(keys.size(), 0);
+    std::vector<u64> used;
+    std::swap(keys, table.keys);
+    std::swap(offsets, table.offsets);
+    std::swap(used, table.used);
+    for (u64 i : used) {
+        offset_table_insert(table, keys[i], offsets[i]);
+    }
 }
 
 
-static node*
-stack_pop(node* stack) {
-    node* tail = stack->parent;
-    stack->parent = nullptr;
-    free_node(stack);
-    return tail;
+static i64*
+offset_table_find(offset_table& table, expr* key) {
+    u64 i = offset_table_slot(table, key);
+    return (table.keys[i] == key) ? &table.offsets[i] : nullptr;
+}
+
+
+static void
+offset_table_insert(offset_table& table, expr* key, i64 offset) {
+    if (2 * (table.used.size() + 1) > table.keys.size()) {
+        offset_table_grow(table);
+    }
+    u64 i = offset_table_slot(table, key);
+    if (table.keys[i] == nullptr) {
+        table.used.push_back(i);
+    }
+    table.keys[i] = key;
+    table.offsets[i] = offset;
 }
 
 
+// scratch buffers owned by the evaluator, so structural walks and image
+// (de)serialisation do no per-node heap allocation once they have grown;
+// evaluator state is per thread so the batch renderer can run scripts in parallel
+typedef struct eval_context {
+    expr_stack decoder;
+    expr_stack fringe;
+    expr_stack walker1;
+    expr_stack walker2;
+    std::vector<i64> marks;
+    std::vector<expr*> refs;
+    offset_table written;
+} eval_context;
+
+static thread_local eval_context context;
+
+
+typedef struct eval_counters {
+    u64 reductions;
+    u64 memo_hits;
+    u64 compressed;
+    u64 arena_bytes;
+} eval_counters;
+
+static thread_local eval_counters eval_stats;
+
+
 typedef struct mem_arena {
     mem_arena* parent;
     u32 used;
@@ -80,8 +167,66 @@ typedef struct mem_arena {
 } mem_arena;
 
 
-static mem_arena* rom;
-static mem_arena* memory;
+static thread_local mem_arena* rom;
+static thread_local mem_arena* memory;
+static thread_local u8 loading_rom;
+
+
+#ifdef GALAXY_PROFILE
+
+typedef struct fun_profile {
+    u64 calls;
+    u64 reductions;
+    u64 bytes;
+} fun_profile;
+
+// a reduction is charged to the definition that owns the reduced combinator
+// node; rom nodes belong to their definition, nodes built by a reduction to the
+// same owner as the reduction. counters are keyed by :NNNN id so they survive
+// machine reloads, -1 collects work on input images
+typedef struct profile_counters {
+    u64 reductions[u32(atom_kind::GG) + 1];
+    u64 memo_hits;
+    u64 memo_misses;
+    u64 alloc_bytes;
+    std::unordered_map<i64, fun_profile> funs;
+    i64 origin = -1;
+    fun_profile* current_fun;
+} profile_counters;
+
+static thread_local profile_counters profile;
+
+
+static fun_profile&
+profile_current_fun() {
+    if (profile.current_fun == nullptr) {
+        profile.current_fun = &profile.funs[profile.origin];
+    }
+    return *profile.current_fun;
+}
+
+
+typedef struct profile_scope {
+    i64 saved;
+
+    profile_scope(i64 origin) : saved(profile.origin) {
+        profile.origin = origin;
+        profile.current_fun = nullptr;
+    }
+
+    ~profile_scope() {
+        profile.origin = saved;
+        profile.current_fun = nullptr;
+    }
+} profile_scope;
+
+#define PROFILE(x) x
+
+#else
+
+#define PROFILE(x)
+
+#endif
 
 
 static void*
@@ -95,10 +240,13 @@ mem_alloc(u32 count, u32 size) {
         auto* block = (mem_arena*) calloc(1, sizeof(mem_arena));
         block->parent = memory;
         memory = block;
+        eval_stats.arena_bytes += sizeof(mem_arena);
     }
 
     u8* p = &memory->buf[memory->used];
     memory->used += total;
+    PROFILE(profile.alloc_bytes += total);
+    PROFILE(profile_current_fun().bytes += total);
     return p;
 }
 
@@ -121,6 +269,8 @@ static expr*
 make_atom(atom_kind kind) {
     expr* e = (expr*)mem_alloc(1, sizeof(expr));
     e->kind = kind;
+    e->rom = loading_rom;
+    PROFILE(e->origin = profile.origin);
     return e;
 }
 
@@ -129,8 +279,10 @@ static expr*
 make_ap(expr* l, expr* r) {
     expr* e = (expr*)mem_alloc(1, sizeof(expr));
     e->kind = atom_kind::ap;
+    e->rom = loading_rom;
     e->l = l;
     e->r = r;
+    PROFILE(e->origin = profile.origin);
     return e;
 }
 
@@ -167,18 +319,15 @@ make_number(i64 value) {
 }
 
 
-static node*
-decoder_reduce(node* stack) {
-    while (stack->parent->e != nullptr && stack->parent->parent->e == nullptr) {
-        expr* r = stack->e;
-        expr* l = stack->parent->e;
-        node* tail = stack->parent->parent->parent;
-        stack->parent->parent->parent = nullptr;
-        free_node(stack);
+static void
+decoder_reduce(expr_stack& stack) {
+    while (stack_at(stack, 1) != nullptr && stack_at(stack, 2) == nullptr) {
+        expr* r = stack_at(stack, 0);
+        expr* l = stack_at(stack, 1);
+        stack.resize(stack.size() - 3);
         auto* cons = make_ap(make_ap(make_cons(), l), r);
-        stack = stack_push(tail, cons);
+        stack.push_back(cons);
     }
-    return stack;
 }
 
 
@@ -198,9 +347,8 @@ number_nibs(u64 number) {
 
 expr*
 decode(const char* text) {
-    node* stack = make_node();
-    stack = stack_push(stack, nullptr);
-    stack = stack_push(stack, nullptr);
+    expr_stack& stack = context.decoder;
+    stack.assign(3, nullptr);
 
     const char* p = text;
     u8 state = 0;
@@ -227,8 +375,8 @@ decode(const char* text) {
         case 1:
             if (c == '0') {
                 state = 0;
-                stack = stack_push(stack, make_nil());
-                stack = decoder_reduce(stack);
+                stack.push_back(make_nil());
+                decoder_reduce(stack);
             }
             else if (c == '1') {
                 state = 3;
@@ -245,7 +393,7 @@ decode(const char* text) {
             }
             else if (c == '1') {
                 state = 0;
-                stack = stack_push(stack, nullptr);
+                stack.push_back(nullptr);
             }
             break;
 
@@ -253,8 +401,8 @@ decode(const char* text) {
             if (c == '0') {
                 if (bits == 0) {
                     state = 0;
-                    stack = stack_push(stack, make_number(0));
-                    stack = decoder_reduce(stack);
+                    stack.push_back(make_number(0));
+                    decoder_reduce(stack);
                 }
                 else {
                     state = 4;
@@ -271,28 +419,26 @@ decode(const char* text) {
             number = (number << 1) | (c != '0' ? 1 : 0);
             if (--bits == 0) {
                 state = 0;
-                stack = stack_push(stack, make_number(neg ? -number : number));
-                stack = decoder_reduce(stack);
+                stack.push_back(make_number(neg ? -number : number));
+                decoder_reduce(stack);
             }
             break;
         }
     }
 
-    expr* e = stack->e;
-    free_node(stack);
-    return e;
+    return stack.back();
 }
 
 
 static const char*
 encode(expr* tree) {
-    const u32 buf_size = 20000;
-    static char buf[buf_size];
-    const char* buf_end = &buf[buf_size-1];
+    static thread_local std::string buf;
+    buf.clear();
 
-    node* stack = make_node(tree);
+    expr_stack& stack = context.fringe;
+    stack.clear();
+    stack.push_back(tree);
 
-    char* p = buf;
     expr* item = nullptr;
     u8 state = 0;
     i64 number;
@@ -300,43 +446,38 @@ encode(expr* tree) {
     u64 bits;
 
     for (u8 done = 0; done == 0; ) {
-        if (p == buf_end) {
-            fatal_error();
-        }
-
         switch (state) {
 
         case 0:
-            if (stack == nullptr) {
+            if (stack.empty()) {
                 done = 1;
-                *p++ = '\0';
                 break;
             }
-            item = stack->e;
-            stack = stack_pop(stack);
+            item = stack.back();
+            stack.pop_back();
             if (item->r != nullptr) {
-                stack = stack_push(stack, item->r);
+                stack.push_back(item->r);
             }
             if (item->l != nullptr) {
-                stack = stack_push(stack, item->l);
+                stack.push_back(item->l);
             }
             switch (item->kind) {
             case atom_kind::ap:
                 if (item->l != nullptr && item->l->kind == atom_kind::ap) {
                     if (item->l->l != nullptr && item->l->l->kind == atom_kind::cons) {
                         state = 1;
-                        *p++ = '1';
+                        buf.push_back('1');
                     }
                 }
                 break;
             case atom_kind::cons: break;
             case atom_kind::nil:
                 state = 1;
-                *p++ = '0';
+                buf.push_back('0');
                 break;
             case atom_kind::number:
                 state = 1;
-                *p++ = (item->number < 0 ? '1' : '0');
+                buf.push_back((item->number < 0 ? '1' : '0'));
                 break;
             default: fatal_error();
             }
@@ -345,22 +486,22 @@ encode(expr* tree) {
         case 1:
             state = 0;
             switch (item->kind) {
-            case atom_kind::ap: *p++ = '1'; break;
-            case atom_kind::nil: *p++ = '0'; break;
+            case atom_kind::ap: buf.push_back('1'); break;
+            case atom_kind::nil: buf.push_back('0'); break;
             case atom_kind::number:
                 state = 3;
-                *p++ = (item->number < 0 ? '0' : '1');
-                nibs = number_nibs(item->number);
-                bits = (u64(8) << ((nibs - 1) * 4));
+                buf.push_back((item->number < 0 ? '0' : '1'));
+                number = (item->number < 0) ? -item->number : item->number;
+                nibs = number_nibs(number);
+                bits = nibs ? (u64(8) << ((nibs - 1) * 4)) : 0;
                 break;
             default: fatal_error();
             }
             break;
 
         case 3:
-            *p++ = (nibs > 0) ? '1' : '0';
+            buf.push_back((nibs > 0) ? '1' : '0');
             if (nibs == 0) {
-                number = (item->number < 0) ? -item->number : item->number;
                 state = (number == 0) ? 0 : 4;
             }
             else {
@@ -369,7 +510,7 @@ encode(expr* tree) {
             break;
 
         case 4:
-            *p++ = (number & bits) == 0 ? '0' : '1';
+            buf.push_back((number & bits) == 0 ? '0' : '1');
             bits >>= 1;
             if (bits == 0) {
                 state = 0;
@@ -378,39 +519,91 @@ encode(expr* tree) {
         }
     }
 
-    return buf;
+    return buf.c_str();
 }
 
 
-static
+static thread_local
 expr* machine = nullptr;
 
-static
-expr* function_table[2000];
+// FUN atoms carry a dense slot, assigned at load time; galaxy is always slot 0
+static thread_local std::vector<expr*> function_table;
+static thread_local std::vector<i64> function_ids;
+static thread_local std::unordered_map<i64, u32> function_slots;
+
+
+static u32
+function_slot(i64 id) {
+    auto it = function_slots.find(id);
+    if (it != function_slots.end()) {
+        return it->second;
+    }
+    u32 slot = function_table.size();
+    function_slots[id] = slot;
+    function_ids.push_back(id);
+    function_table.push_back(nullptr);
+    return slot;
+}
+
+
+static i64
+function_id(u32 slot) {
+    if (slot >= function_ids.size()) {
+        fatal_error();
+    }
+    return function_ids[slot];
+}
+
+
+static expr*
+function_body(u32 slot) {
+    if (slot >= function_table.size() || function_table[slot] == nullptr) {
+        fprintf(stderr, "galaxy: undefined function :%lld\n", (long long) (slot < function_ids.size() ? function_ids[slot] : -1));
+        fatal_error();
+    }
+    return function_table[slot];
+}
+
+
+static void
+reset_function_table() {
+    function_table.clear();
+    function_ids.clear();
+    function_slots.clear();
+    function_slot(0);
+}
 
 
-static node*
-machine_decode_reduce(node* stack) {
-    while (stack->parent->e != nullptr && stack->parent->parent->e == nullptr) {
-        expr* r = stack->e;
-        stack = stack_pop(stack);
-        expr* l = stack->e;
-        stack = stack_pop(stack);
-        stack = stack_pop(stack);
+static void
+machine_decode_reduce(expr_stack& stack, u8 refs_enabled) {
+    while (stack_at(stack, 1) != nullptr && stack_at(stack, 2) == nullptr) {
+        expr* r = stack_at(stack, 0);
+        expr* l = stack_at(stack, 1);
+        stack.resize(stack.size() - 3);
         expr* ap = make_ap(l, r);
-        stack = stack_push(stack, ap);
+        stack.push_back(ap);
+        if (refs_enabled) {
+            context.refs[context.marks.back()] = ap;
+            context.marks.pop_back();
+        }
     }
-    return stack;
 }
 
 
+// with refs enabled, REF <offset> resolves to the ap node starting at that
+// token offset of the image, which must already be complete
 static expr*
-machine_decode_expr(const i64* reader, u32 scan_size) {
-    node* stack = nullptr;
+machine_decode_expr(const i64* reader, u32 scan_size, u8 refs_enabled = 0) {
+    const i64* start = reader;
+    if (refs_enabled) {
+        context.marks.clear();
+        context.refs.assign(scan_size, nullptr);
+    }
 
-    stack = make_node();
-    stack = stack_push(stack, make_nil());
-    stack = stack_push(stack, make_nil());
+    expr_stack& stack = context.decoder;
+    stack.assign(1, nullptr);
+    stack.push_back(make_nil());
+    stack.push_back(make_nil());
 
     while (scan_size > 0) {
         expr* token = make_atom(atom_kind(*reader++));
@@ -419,7 +612,10 @@ machine_decode_expr(const i64* reader, u32 scan_size) {
         case atom_kind::ap:
             if (scan_size < 1) fatal_error();
             --scan_size;
-            stack = stack_push(stack, nullptr);
+            if (refs_enabled) {
+                context.marks.push_back(reader - start - 1);
+            }
+            stack.push_back(nullptr);
             break;
 
         case atom_kind::cons:
@@ -442,8 +638,8 @@ machine_decode_expr(const i64* reader, u32 scan_size) {
         case atom_kind::galaxy:
             if (scan_size < 1) fatal_error();
             --scan_size;
-            stack = stack_push(stack, token);
-            stack = machine_decode_reduce(stack);
+            stack.push_back(token);
+            machine_decode_reduce(stack, refs_enabled);
             break;
 
         case atom_kind::number:
@@ -451,10 +647,23 @@ machine_decode_expr(const i64* reader, u32 scan_size) {
             if (scan_size < 2) fatal_error();
             scan_size -= 2;
             token->number = *reader++;
-            stack = stack_push(stack, token);
-            stack = machine_decode_reduce(stack);
+            if (token->kind == atom_kind::FUN) {
+                token->number = function_slot(token->number);
+            }
+            stack.push_back(token);
+            machine_decode_reduce(stack, refs_enabled);
             break;
 
+        case atom_kind::REF: {
+            if (!refs_enabled || scan_size < 2) fatal_error();
+            scan_size -= 2;
+            i64 offset = *reader++;
+            if (offset < 0 || u64(offset) >= context.refs.size() || context.refs[offset] == nullptr) fatal_error();
+            stack.push_back(context.refs[offset]);
+            machine_decode_reduce(stack, refs_enabled);
+            break;
+        }
+
         case atom_kind::SCAN:
         case atom_kind::DEF:
         case atom_kind::GG:
@@ -462,15 +671,13 @@ machine_decode_expr(const i64* reader, u32 scan_size) {
         }
     }
 
-    expr* e = stack->e;
-    free_node(stack);
-    return e;
+    return stack.back();
 }
 
 
 static expr*
 load_machine_image(const i64* reader) {
-    *function_table = {};
+    reset_function_table();
     u8 state = 0;
     u32 scan_size = 0;
     expr* function = nullptr;
@@ -500,7 +707,7 @@ load_machine_image(const i64* reader) {
                 scan_size -= 2;
                 state = 2;
                 function = make_atom(token_kind);
-                function->number = *reader++;
+                function->number = function_slot(*reader++);
                 if (token_kind == atom_kind::galaxy) {
                     galaxy = function;
                 }
@@ -511,13 +718,15 @@ load_machine_image(const i64* reader) {
 
         case 2:
             switch (token_kind) {
-            case atom_kind::DEF:
+            case atom_kind::DEF: {
                 if (scan_size < 1) fatal_error();
                 --scan_size;
                 state = 0;
+                PROFILE(profile_scope scope(function_id(function->number)));
                 function_table[function->number] = machine_decode_expr(reader, scan_size);
                 reader += scan_size;
                 break;
+            }
             default: fatal_error();
             }
             break;
@@ -535,18 +744,33 @@ ElementCount(T(&)[N]) {
 }
 
 
+// with share set, an ap node written before is emitted as REF <offset>
 static i64*
-write_machine_image(i64* p, expr* e) {
-    node* fringe = nullptr;
-    fringe = stack_push(fringe, e);
-    while (fringe != nullptr) {
-        expr* e = fringe->e;
-        fringe = stack_pop(fringe);
+write_machine_image(i64* p, expr* e, u8 share = 0) {
+    const i64* start = p;
+    offset_table& written = context.written;
+    if (share) {
+        offset_table_clear(written);
+    }
+    expr_stack& fringe = context.fringe;
+    fringe.clear();
+    fringe.push_back(e);
+    while (!fringe.empty()) {
+        expr* e = fringe.back();
+        fringe.pop_back();
+        if (share && e->kind == atom_kind::ap) {
+            if (i64* offset = offset_table_find(written, e)) {
+                *p++ = u8(atom_kind::REF);
+                *p++ = *offset;
+                continue;
+            }
+            offset_table_insert(written, e, p - start);
+        }
         if (e->r != nullptr) {
-            fringe = stack_push(fringe, e->r);
+            fringe.push_back(e->r);
         }
         if (e->l != nullptr) {
-            fringe = stack_push(fringe, e->l);
+            fringe.push_back(e->l);
         }
 
         switch(e->kind) {
@@ -572,15 +796,20 @@ write_machine_image(i64* p, expr* e) {
             break;
 
         case atom_kind::number:
-        case atom_kind::FUN:
             *p++ = u8(e->kind);
             *p++ = e->number;
             break;
 
+        case atom_kind::FUN:
+            *p++ = u8(e->kind);
+            *p++ = function_id(e->number);
+            break;
+
         case atom_kind::galaxy:
         case atom_kind::SCAN:
         case atom_kind::DEF:
         case atom_kind::GG:
+        case atom_kind::REF:
             fatal_error();
         }
 
@@ -591,17 +820,17 @@ write_machine_image(i64* p, expr* e) {
 
 static i64*
 machine_encode_result(expr* e, u32* size = nullptr) {
-    static i64 dump[100000];
-    i64* p = dump;
-    p = write_machine_image(p, e);
+    static thread_local std::vector<i64> dump(100000);
+    i64* p = dump.data();
+    p = write_machine_image(p, e, 1);
     *p++ = u8(atom_kind::GG);
-    if (p > dump + sizeof(dump)) {
+    if (p > dump.data() + dump.size()) {
         fatal_error();
     }
     if (size != nullptr) {
-        *size = p - dump;
+        *size = p - dump.data();
     }
-    return dump;
+    return dump.data();
 }
 
 
@@ -610,16 +839,17 @@ check_machine() {
     static i64 dump[ElementCount(galaxy_machine_image)];
     i64* p = dump;
 
-    for (u32 i = 1; i < ElementCount(function_table); ++i) {
-        expr* e = function_table[i];
-        if (e == nullptr) {
+    std::map<i64, u32> ordered(function_slots.begin(), function_slots.end());
+    for (auto& [id, slot] : ordered) {
+        expr* e = function_table[slot];
+        if (slot == 0 || e == nullptr) {
             continue;
         }
 
         *p++ = u8(atom_kind::SCAN);
         auto* n = p++;
         *p++ = u8(atom_kind::FUN);
-        *p++ = i;
+        *p++ = id;
         *p++ = u8(atom_kind::DEF);
         p = write_machine_image(p, e);
         *n = p - n - 1;
@@ -650,54 +880,57 @@ check_machine() {
 
 static u8
 equal(expr* a, expr* b) {
-    node* walker1 = nullptr;
-    node* walker2 = nullptr;
-    walker1 = stack_push(walker1, a);
-    walker2 = stack_push(walker2, b);
+    expr_stack& walker1 = context.walker1;
+    expr_stack& walker2 = context.walker2;
+    walker1.clear();
+    walker2.clear();
+    walker1.push_back(a);
+    walker2.push_back(b);
 
-    while (walker1 != nullptr && walker2 != nullptr) {
-        expr* a = walker1->e;
-        expr* b = walker2->e;
+    while (!walker1.empty() && !walker2.empty()) {
+        expr* a = walker1.back();
+        expr* b = walker2.back();
 
         if (a->kind != b->kind) {
-            break;
+            return 0;
         }
 
-        walker1 = stack_pop(walker1);
-        walker2 = stack_pop(walker2);
+        walker1.pop_back();
+        walker2.pop_back();
 
         if (a->r != nullptr) {
             if (b->r == nullptr) {
-                break;
+                return 0;
             }
-            walker1 = stack_push(walker1, a->r);
-            walker2 = stack_push(walker2, b->r);
+            walker1.push_back(a->r);
+            walker2.push_back(b->r);
         }
         if (a->l != nullptr) {
             if (b->l == nullptr) {
-                break;
+                return 0;
             }
-            walker1 = stack_push(walker1, a->l);
-            walker2 = stack_push(walker2, b->l);
+            walker1.push_back(a->l);
+            walker2.push_back(b->l);
         }
 
         if (a->kind == atom_kind::number || a->kind == atom_kind::FUN) {
             if (a->number != b->number) {
-                break;
+                return 0;
             }
         }
     }
 
-    if (walker1 == nullptr && walker2 == nullptr) {
-        return 1;
-    }
-
-    free_node(walker1);
-    free_node(walker2);
-    return 0;
+    return walker1.empty() && walker2.empty();
 }
 
 
+// reductions walk a chain of intermediates; each one is left pointing at its
+// successor, and with path compression the chain is then repointed at the
+// final result, ap nodes being overwritten with it in place as in classic
+// graph reduction; set per thread like the rest of the evaluator state
+static thread_local u8 path_compression = 1;
+
+
 static expr*
 galaxy_eval(expr* input);
 
@@ -709,8 +942,27 @@ as_number(expr* e) {
 }
 
 
+#ifdef GALAXY_PROFILE
+
+static void
+profile_reduction(atom_kind kind, i64 origin) {
+    ++profile.reductions[u32(kind)];
+    ++profile.funs[origin].reductions;
+}
+
+
+static void
+profile_call(u32 slot) {
+    ++profile.funs[function_id(slot)].calls;
+}
+
+#endif
+
+
 static expr*
 galaxy_eval_ap1(expr* fun, expr* x) {
+    PROFILE(profile_reduction(fun->kind, fun->origin));
+    PROFILE(profile_scope scope(fun->origin));
     switch (fun->kind) {
         case atom_kind::nil: return make_t();
         case atom_kind::neg: return make_number(-as_number(x));
@@ -725,6 +977,8 @@ galaxy_eval_ap1(expr* fun, expr* x) {
 
 static expr*
 galaxy_eval_ap2(expr* fun, expr* x, expr* y) {
+    PROFILE(profile_reduction(fun->kind, fun->origin));
+    PROFILE(profile_scope scope(fun->origin));
     switch (fun->kind) {
     case atom_kind::t: return y;
     case atom_kind::f: return x;
@@ -745,6 +999,8 @@ galaxy_eval_ap2(expr* fun, expr* x, expr* y) {
 
 static expr*
 galaxy_eval_ap3(expr* fun, expr* x, expr* y, expr* z) {
+    PROFILE(profile_reduction(fun->kind, fun->origin));
+    PROFILE(profile_scope scope(fun->origin));
     switch (fun->kind) {
     case atom_kind::s: return make_ap(make_ap(z, x), make_ap(y, x));
     case atom_kind::c: return make_ap(make_ap(z, x), y);
@@ -812,14 +1068,332 @@ galaxy_eval_ap(expr* input) {
 }
 
 
+// native implementations of hot galaxy functions, bound by FUN number.
+// arguments are passed in application order; returning nullptr declines
+// and the call is reduced by the interpreter as usual.
+typedef expr* (*native_fn)(expr** args);
+
+typedef struct native_binding {
+    u32 arity;
+    native_fn fn;
+} native_binding;
+
+static const u32 native_max_arity = 3;
+static thread_local std::vector<native_binding> native_table;
+
+enum class native_modes : u32 {
+    off = 0,
+    on = 1,
+    verify = 2,
+};
+
+// per thread, verify mode switches it off around the interpreted run
+static thread_local native_modes native_mode = native_modes::on;
+
+
+static u8
+is_cons_cell(expr* e) {
+    return e->kind == atom_kind::ap && e->l->kind == atom_kind::ap && e->l->l->kind == atom_kind::cons;
+}
+
+
+static u8
+native_number(expr* e, i64* value) {
+    expr* r = galaxy_eval(e);
+    if (r->kind != atom_kind::number) {
+        return 0;
+    }
+    *value = r->number;
+    return 1;
+}
+
+
+static u8
+native_list(expr* e, std::vector<expr*>& items) {
+    for (e = galaxy_eval(e); e->kind != atom_kind::nil; e = galaxy_eval(e->r)) {
+        if (!is_cons_cell(e)) {
+            return 0;
+        }
+        items.push_back(e->l->r);
+    }
+    return 1;
+}
+
+
+static expr*
+native_cons(expr* head, expr* tail) {
+    return make_ap(make_ap(make_cons(), head), tail);
+}
+
+
+static expr*
+native_make_list(const std::vector<expr*>& items, expr* tail) {
+    for (auto it = items.rbegin(); it != items.rend(); ++it) {
+        tail = native_cons(*it, tail);
+    }
+    return tail;
+}
+
+
+static expr*
+native_pow2(expr** args) {
+    i64 n;
+    if (!native_number(args[0], &n) || n < 0 || n > 62) {
+        return nullptr;
+    }
+    return make_number(i64(1) << n);
+}
+
+
+static expr*
+native_log2(expr** args) {
+    i64 n;
+    if (!native_number(args[0], &n)) {
+        return nullptr;
+    }
+    i64 r = 0;
+    for (; n >= 2; n /= 2, ++r) {
+    }
+    return make_number(r);
+}
+
+
+static expr*
+native_abs(expr** args) {
+    i64 n;
+    if (!native_number(args[0], &n)) {
+        return nullptr;
+    }
+    return make_number(n < 0 ? -n : n);
+}
+
+
+static expr*
+native_max(expr** args) {
+    i64 a, b;
+    if (!native_number(args[0], &a) || !native_number(args[1], &b)) {
+        return nullptr;
+    }
+    return make_number(a < b ? b : a);
+}
+
+
+static expr*
+native_min(expr** args) {
+    i64 a, b;
+    if (!native_number(args[0], &a) || !native_number(args[1], &b)) {
+        return nullptr;
+    }
+    return make_number(a < b ? a : b);
+}
+
+
+static expr*
+native_map(expr** args) {
+    std::vector<expr*> items;
+    if (!native_list(args[0], items)) {
+        return nullptr;
+    }
+    for (auto& x : items) {
+        x = make_ap(args[1], x);
+    }
+    return native_make_list(items, make_nil());
+}
+
+
+static expr*
+native_length(expr** args) {
+    std::vector<expr*> items;
+    if (!native_list(args[0], items)) {
+        return nullptr;
+    }
+    return make_number(items.size());
+}
+
+
+static expr*
+native_append(expr** args) {
+    std::vector<expr*> items;
+    if (!native_list(args[0], items)) {
+        return nullptr;
+    }
+    return native_make_list(items, args[1]);
+}
+
+
+static expr*
+native_foldr(expr** args) {
+    std::vector<expr*> items;
+    if (!native_list(args[0], items)) {
+        return nullptr;
+    }
+    expr* acc = args[1];
+    for (auto it = items.rbegin(); it != items.rend(); ++it) {
+        acc = make_ap(make_ap(args[2], acc), *it);
+    }
+    return acc;
+}
+
+
+static expr*
+native_concat(expr** args) {
+    std::vector<expr*> lists;
+    std::vector<expr*> items;
+    if (!native_list(args[0], lists)) {
+        return nullptr;
+    }
+    for (expr* xs : lists) {
+        if (!native_list(xs, items)) {
+            return nullptr;
+        }
+    }
+    return native_make_list(items, make_nil());
+}
+
+
+static expr*
+native_range(expr** args) {
+    i64 n;
+    if (!native_number(args[0], &n) || n < 0) {
+        return nullptr;
+    }
+    expr* res = make_nil();
+    for (i64 i = 0; i < n; ++i) {
+        res = native_cons(make_number(i), res);
+    }
+    return res;
+}
+
+
+static expr*
+native_nth(expr** args) {
+    std::vector<expr*> items;
+    i64 i;
+    if (!native_list(args[0], items) || !native_number(args[1], &i) || i < 0 || u64(i) >= items.size()) {
+        return nullptr;
+    }
+    return items[i];
+}
+
+
+static expr*
+native_vec_add(expr** args) {
+    expr* a = galaxy_eval(args[0]);
+    expr* b = galaxy_eval(args[1]);
+    if (!is_cons_cell(a) || !is_cons_cell(b)) {
+        return nullptr;
+    }
+    expr* x = make_ap(make_ap(make_atom(atom_kind::add), a->l->r), b->l->r);
+    expr* y = make_ap(make_ap(make_atom(atom_kind::add), a->r), b->r);
+    return native_cons(x, y);
+}
+
+
+static void
+bind_native(i64 id, u32 arity, native_fn fn) {
+    auto it = function_slots.find(id);
+    if (it == function_slots.end()) {
+        return;
+    }
+    if (native_table.size() < function_table.size()) {
+        native_table.resize(function_table.size());
+    }
+    native_table[it->second] = {arity, fn};
+}
+
+
+// list natives force the whole spine of their list arguments. that matches
+// the interpreter only because cons reduction (galaxy_eval_ap2) evaluates head
+// and tail, so an evaluated list always has an evaluated spine; other arguments
+// go into the result unevaluated, as the interpreter leaves them. do not bind
+// a function that is lazy in a list argument, e.g. one taking a prefix of an
+// endless list: the native would not terminate, and verify mode cannot tell.
+static void
+register_natives() {
+    bind_native(1117, 1, native_pow2);
+    bind_native(1118, 1, native_log2);
+    bind_native(1120, 1, native_abs);
+    bind_native(1121, 2, native_max);
+    bind_native(1122, 2, native_min);
+    bind_native(1126, 2, native_map);
+    bind_native(1128, 1, native_length);
+    bind_native(1131, 2, native_append);
+    bind_native(1133, 3, native_foldr);
+    bind_native(1134, 1, native_concat);
+    bind_native(1138, 1, native_range);
+    bind_native(1141, 2, native_nth);
+    bind_native(1172, 2, native_vec_add);
+}
+
+
+static void
+clear_natives() {
+    native_table.clear();
+}
+
+
+static expr*
+galaxy_eval_native(expr* input) {
+    expr* args[native_max_arity];
+    u32 argc = 0;
+    expr* e = input;
+    for (; e->kind == atom_kind::ap && argc < native_max_arity; e = e->l) {
+        args[native_max_arity - ++argc] = e->r;
+    }
+
+    if (e->kind != atom_kind::FUN || u64(e->number) >= native_table.size()) {
+        return nullptr;
+    }
+    auto& binding = native_table[e->number];
+    if (binding.fn == nullptr || binding.arity != argc) {
+        return nullptr;
+    }
+
+#ifdef GALAXY_PROFILE
+    profile_scope scope(function_id(e->number));
+#endif
+    expr* res = binding.fn(&args[native_max_arity - argc]);
+#ifdef GALAXY_PROFILE
+    if (res != nullptr) {
+        profile_reduction(atom_kind::FUN, e->origin);
+        profile_call(e->number);
+    }
+#endif
+    if (res == nullptr || native_mode != native_modes::verify) {
+        return res;
+    }
+
+    native_mode = native_modes::off;
+    expr* expected = galaxy_eval(galaxy_eval_ap(input));
+    native_mode = native_modes::verify;
+
+    if (!equal(galaxy_eval(res), expected)) {
+        fatal_error();
+    }
+    return res;
+}
+
+
 static expr*
 galaxy_try_eval(expr* input) {
     if (input->evaluated != nullptr) {
+        PROFILE(++profile.memo_hits);
+        ++eval_stats.memo_hits;
         return input->evaluated;
     }
+#ifdef GALAXY_PROFILE
+    if (input->kind == atom_kind::ap) {
+        ++profile.memo_misses;
+    }
+#endif
 
     switch (input->kind) {
     case atom_kind::ap:
+        if (native_mode != native_modes::off) {
+            if (expr* res = galaxy_eval_native(input)) {
+                return res;
+            }
+        }
         return galaxy_eval_ap(input);
 
     case atom_kind::cons:
@@ -844,25 +1418,83 @@ galaxy_try_eval(expr* input) {
 
     case atom_kind::FUN:
     case atom_kind::galaxy:
-        return function_table[input->number];
+        PROFILE(profile_reduction(input->kind, input->origin));
+        PROFILE(profile_call(input->number));
+        return function_body(input->number);
 
     case atom_kind::DEF:
     case atom_kind::SCAN:
     case atom_kind::GG:
+    case atom_kind::REF:
         fatal_error();
     }
 }
 
 
+typedef struct rom_save {
+    expr* node;
+    expr saved;
+} rom_save;
+
+// rom nodes are memoized and compressed like any other during a call, but the
+// results live in the call arena. the first write to a rom node saves it here,
+// release_memory puts it back before the arena goes away
+static thread_local std::vector<rom_save> rom_trail;
+
+
+static void
+trail(expr* e) {
+    if (e->rom && !e->trailed) {
+        rom_trail.push_back({e, *e});
+        e->trailed = 1;
+    }
+}
+
+
+static void
+release_memory() {
+    for (auto it = rom_trail.rbegin(); it != rom_trail.rend(); ++it) {
+        *it->node = it->saved;
+    }
+    rom_trail.clear();
+    mem_release(memory);
+    memory = nullptr;
+}
+
+
+static void
+compress_chain(expr* e, expr* r) {
+    while (e != r) {
+        expr* next = e->evaluated;
+        trail(e);
+        if (e->kind == atom_kind::ap) {
+            u8 rom = e->rom, trailed = e->trailed;
+            *e = *r;
+            e->rom = rom;
+            e->trailed = trailed;
+        }
+        e->evaluated = r;
+        ++eval_stats.compressed;
+        e = next;
+    }
+}
+
+
 static expr*
 galaxy_eval(expr* input) {
     for (expr* e = input; ;) {
         expr* r = galaxy_try_eval(e);
         if (r == e) {
-        // if ((r == e) || (r->kind == atom_kind::ap && equal(r, e))) {
+            if (path_compression) {
+                compress_chain(input, r);
+            }
+            trail(input);
             input->evaluated = r;
             return r;
         }
+        trail(e);
+        e->evaluated = r;
+        ++eval_stats.reductions;
         e = r;
     }
 }
@@ -871,15 +1503,20 @@ galaxy_eval(expr* input) {
 static void
 load_galaxy_machine() {
     load_machine(galaxy_machine_image);
+    register_natives();
     // check_machine();
 }
 
 
 const void
 load_machine(const i64* image) {
+    // the saved rom nodes go away with the rom
+    rom_trail.clear();
     mem_release(rom);
     machine = nullptr;
     rom = nullptr;
+    clear_natives();
+    reset_function_table();
 
     if (image == nullptr) {
         return;
@@ -888,7 +1525,9 @@ load_machine(const i64* image) {
     auto* save_memory = memory;
     memory = nullptr;
 
+    loading_rom = 1;
     machine = load_machine_image(image);
+    loading_rom = 0;
 
     rom = memory;
     memory = save_memory;
@@ -905,72 +1544,459 @@ evaluate(u32 request_size, const i64* request) {
         load_galaxy_machine();
     }
 
-    expr* state = machine_decode_expr(request, request_size);
+    expr* state = machine_decode_expr(request, request_size, 1);
 
     expr* new_state = galaxy_eval(state);
     auto* res = machine_encode_result(new_state);
 
-    mem_release(memory);
-    memory = nullptr;
+    release_memory();
+
+    return res;
+}
+
+
+// alien wire format straight to and from machine images, without going
+// through python lists
+const char*
+modulate_expr(u32 size, const i64* image) {
+    if (image == nullptr) {
+        return nullptr;
+    }
+
+    expr* e = machine_decode_expr(image, size, 1);
+    const char* res = encode(e);
+
+    release_memory();
+
+    return res;
+}
+
+
+const i64*
+demodulate_to_image(const char* text, u32* size) {
+    if (text == nullptr) {
+        return nullptr;
+    }
+
+    expr* e = decode(text);
+    i64* res = (e != nullptr) ? machine_encode_result(e, size) : nullptr;
+
+    release_memory();
 
     return res;
 }
 
 
+const i64*
+galaxy_profile(u32* size) {
+#ifdef GALAXY_PROFILE
+    static thread_local std::vector<i64> dump;
+    dump.resize(6 + ElementCount(profile.reductions) + 4 * profile.funs.size());
+    i64* p = dump.data();
+
+    *p++ = ElementCount(profile.reductions);
+    for (u64 n : profile.reductions) {
+        *p++ = n;
+    }
+    *p++ = profile.memo_hits;
+    *p++ = profile.memo_misses;
+    *p++ = profile.alloc_bytes;
+
+    auto* count = p++;
+    *count = 0;
+    std::map<i64, fun_profile> ordered(profile.funs.begin(), profile.funs.end());
+    for (auto& [id, fun] : ordered) {
+        if (fun.calls == 0 && fun.reductions == 0 && fun.bytes == 0) {
+            continue;
+        }
+        *p++ = id;
+        *p++ = fun.calls;
+        *p++ = fun.reductions;
+        *p++ = fun.bytes;
+        ++*count;
+    }
+
+    if (size != nullptr) {
+        *size = p - dump.data();
+    }
+    return dump.data();
+#else
+    if (size != nullptr) {
+        *size = 0;
+    }
+    return nullptr;
+#endif
+}
+
+
+const void
+galaxy_profile_reset() {
+    PROFILE(profile = {});
+}
+
+
+const void
+galaxy_native_mode(u32 mode) {
+    native_mode = native_modes(mode);
+}
+
+
 #ifdef GALAXY_RENDERER
 
-template <class I>
+#include <atomic>
+#include <chrono>
+#include <filesystem>
+#include <thread>
+
+
+// headless batch renderer: replays click scripts against the galaxy and dumps
+// the frames, one independent interpreter per worker thread
+//
+//   render [--boot] [-j N] [-o DIR] [-f png|points|none] [--no-compression] [FILE|- ...]
+//
+// scripts are JSON, [[x,y],...] for one script or [[[x,y],...],...] for many,
+// or CSV with one "x,y" click per line and blank lines between scripts
+
+typedef std::pair<i32, i32> point;
+typedef std::vector<point> click_script;
+typedef std::vector<std::vector<point>> frame_layers;
+
+static const click_script boot_sequence = {
+    {0, 0},
+    {0, 0},
+    {0, 0},
+    {0, 0},
+    {0, 0},
+    {0, 0},
+    {0, 0},
+    {0, 0},
+    {8, 4},
+    {2, -8},
+    {3, 6},
+    {0, -14},
+    {-4, 10},
+    {9, -3},
+    {-4, 10},
+    {1, 4},
+};
+
+
+enum class frame_format {
+    none,
+    png,
+    points,
+};
+
+typedef struct render_options {
+    u8 boot;
+    u8 compression;
+    u32 jobs;
+    std::string output;
+    frame_format format;
+} render_options;
+
+typedef struct step_timing {
+    point mouse;
+    i64 flag;
+    double ms;
+} step_timing;
+
+typedef struct script_report {
+    std::vector<step_timing> steps;
+    eval_counters stats;
+    u8 failed;
+} script_report;
+
+
+static bool
+parse_json_scripts(const std::string& text, std::vector<click_script>& scripts) {
+    u32 depth = 0;
+    u32 max_depth = 0;
+    for (char c : text) {
+        if (c == '[') {
+            max_depth = std::max(max_depth, ++depth);
+        }
+        else if (c == ']') {
+            if (depth == 0) {
+                return false;
+            }
+            --depth;
+        }
+    }
+    if (depth != 0 || max_depth < 2 || max_depth > 3) {
+        return false;
+    }
+    if (max_depth == 2) {
+        scripts.emplace_back();
+    }
+
+    std::vector<i64> numbers;
+    const char* p = text.c_str();
+    while (*p != 0) {
+        char c = *p;
+        if (c == '[') {
+            if (++depth == 2 && max_depth == 3) {
+                scripts.emplace_back();
+            }
+            numbers.clear();
+            ++p;
+        }
+        else if (c == ']') {
+            if (depth-- == max_depth) {
+                if (numbers.size() != 2) {
+                    return false;
+                }
+                scripts.back().emplace_back(i32(numbers[0]), i32(numbers[1]));
+            }
+            ++p;
+        }
+        else if (c == '-' || (c >= '0' && c <= '9')) {
+            char* end = nullptr;
+            numbers.push_back(strtoll(p, &end, 10));
+            p = end;
+        }
+        else {
+            ++p;
+        }
+    }
+    return true;
+}
+
+
+static bool
+parse_csv_scripts(const std::string& text, std::vector<click_script>& scripts) {
+    click_script script;
+    size_t start = 0;
+    while (start <= text.size()) {
+        size_t end = text.find('\n', start);
+        if (end == std::string::npos) {
+            end = text.size();
+        }
+        std::string line = text.substr(start, end - start);
+        start = end + 1;
+
+        line = line.substr(0, line.find('#'));
+        if (line.find_first_not_of(" \t\r") == std::string::npos) {
+            if (!script.empty()) {
+                scripts.push_back(std::move(script));
+                script.clear();
+            }
+            continue;
+        }
+
+        int x = 0, y = 0;
+        if (sscanf(line.c_str(), " %d , %d", &x, &y) != 2 && sscanf(line.c_str(), " %d %d", &x, &y) != 2) {
+            return false;
+        }
+        script.emplace_back(x, y);
+    }
+    if (!script.empty()) {
+        scripts.push_back(std::move(script));
+    }
+    return true;
+}
+
+
+static bool
+read_scripts(const char* fn, std::vector<click_script>& scripts) {
+    FILE* fp = (strcmp(fn, "-") == 0) ? stdin : fopen(fn, "rb");
+    if (fp == nullptr) {
+        fprintf(stderr, "%s: cannot open\n", fn);
+        return false;
+    }
+    std::string text;
+    char buf[4096];
+    for (size_t n; (n = fread(buf, 1, sizeof(buf), fp)) > 0;) {
+        text.append(buf, n);
+    }
+    if (fp != stdin) {
+        fclose(fp);
+    }
+
+    size_t first = text.find_first_not_of(" \t\r\n");
+    if (first == std::string::npos) {
+        return true;
+    }
+    bool ok = (text[first] == '[') ? parse_json_scripts(text, scripts) : parse_csv_scripts(text, scripts);
+    if (!ok) {
+        fprintf(stderr, "%s: malformed click script\n", fn);
+    }
+    return ok;
+}
+
+
 static void
-print_array(const I* ar, u32 size) {
-    printf("[");
-    for (u32 i = 0; i + 1 < size; ++i) {
-        printf("%lld, ", (i64) ar[i]);
+read_layers(expr* frames, frame_layers& layers) {
+    for (expr* e = frames; e->kind == atom_kind::ap; e = e->r) {
+        auto& layer = layers.emplace_back();
+        for (expr* q = e->l->r; q->kind == atom_kind::ap; q = q->r) {
+            expr* pair = q->l->r;
+            layer.emplace_back(i32(as_number(pair->l->r)), i32(as_number(pair->r)));
+        }
     }
-    printf("%lld", (i64) ar[size-1]);
-    printf("]\n");
+}
+
+
+static u32
+crc32(u32 crc, const u8* data, size_t size) {
+    static const auto table = [] {
+        std::vector<u32> table(256);
+        for (u32 n = 0; n < 256; ++n) {
+            u32 c = n;
+            for (u8 k = 0; k < 8; ++k) {
+                c = (c & 1) ? 0xedb88320 ^ (c >> 1) : c >> 1;
+            }
+            table[n] = c;
+        }
+        return table;
+    }();
+    crc = ~crc;
+    for (size_t i = 0; i < size; ++i) {
+        crc = table[(crc ^ data[i]) & 0xff] ^ (crc >> 8);
+    }
+    return ~crc;
 }
 
 
 static void
-print_encoded_array(expr* e) {
-    u32 size = 0;
-    i64* ar = machine_encode_result(e, &size);
-    print_array(ar, size);
+put_u32be(std::vector<u8>& out, u32 value) {
+    for (i32 shift = 24; shift >= 0; shift -= 8) {
+        out.push_back(u8(value >> shift));
+    }
 }
 
 
-int main(int argc, char const *argv[]) {
-    const i32 inputs[][2] = {
-        {0, 0},
-        {0, 0},
-        {0, 0},
-        {0, 0},
-        {0, 0},
-        {0, 0},
-        {0, 0},
-        {0, 0},
-        {8, 4},
-        {2, -8},
-        {3, 6},
-        {0, -14},
-        {-4, 10},
-        {9, -3},
-        {-4, 10},
-        {1, 4},
-    };
+static void
+put_u32le(std::vector<u8>& out, u32 value) {
+    for (u32 shift = 0; shift < 32; shift += 8) {
+        out.push_back(u8(value >> shift));
+    }
+}
 
-    u32 scan_size = 0;
-    i64* side = machine_encode_result(make_nil(), &scan_size);
 
-    for (auto& mouse : inputs) {
-        printf("\n");
-        print_array(mouse, 2);
+static void
+put_png_chunk(std::vector<u8>& out, const char* tag, const std::vector<u8>& data) {
+    put_u32be(out, data.size());
+    size_t start = out.size();
+    out.insert(out.end(), tag, tag + 4);
+    out.insert(out.end(), data.begin(), data.end());
+    put_u32be(out, crc32(0, &out[start], out.size() - start));
+}
+
+
+// grayscale, one pixel per point, front layer brightest; pixels go into
+// stored deflate blocks, frames are small enough not to bother compressing
+static std::vector<u8>
+encode_png(const frame_layers& layers) {
+    i32 x0 = 0, y0 = 0, x1 = 0, y1 = 0;
+    bool empty = true;
+    for (auto& layer : layers) {
+        for (auto [x, y] : layer) {
+            x0 = empty ? x : std::min(x0, x);
+            y0 = empty ? y : std::min(y0, y);
+            x1 = empty ? x : std::max(x1, x);
+            y1 = empty ? y : std::max(y1, y);
+            empty = false;
+        }
+    }
+    u32 width = x1 - x0 + 1;
+    u32 height = y1 - y0 + 1;
+    u32 stride = width + 1;
+
+    std::vector<u8> raw(size_t(stride) * height);
+    for (size_t i = layers.size(); i-- > 0;) {
+        u8 shade = 255 - i * 192 / layers.size();
+        for (auto [x, y] : layers[i]) {
+            raw[size_t(y - y0) * stride + 1 + (x - x0)] = shade;
+        }
+    }
+
+    std::vector<u8> idat = {0x78, 0x01};
+    u32 a = 1, b = 0;
+    for (size_t i = 0; i < raw.size(); ++i) {
+        a = (a + raw[i]) % 65521;
+        b = (b + a) % 65521;
+    }
+    size_t offset = 0;
+    do {
+        u32 n = std::min<size_t>(raw.size() - offset, 0xffff);
+        idat.push_back(offset + n == raw.size());
+        idat.insert(idat.end(), {u8(n), u8(n >> 8), u8(~n), u8(~n >> 8)});
+        idat.insert(idat.end(), raw.begin() + offset, raw.begin() + offset + n);
+        offset += n;
+    } while (offset < raw.size());
+    put_u32be(idat, (b << 16) | a);
+
+    std::vector<u8> header;
+    put_u32be(header, width);
+    put_u32be(header, height);
+    header.insert(header.end(), {8, 0, 0, 0, 0});
+
+    std::vector<u8> out = {0x89, 'P', 'N', 'G', '\r', '\n', 0x1a, '\n'};
+    put_png_chunk(out, "IHDR", header);
+    put_png_chunk(out, "IDAT", idat);
+    put_png_chunk(out, "IEND", {});
+    return out;
+}
+
+
+// "GPTS", layer count, then per layer a point count and x, y pairs,
+// all little endian 32-bit
+static std::vector<u8>
+encode_points(const frame_layers& layers) {
+    std::vector<u8> out = {'G', 'P', 'T', 'S'};
+    put_u32le(out, layers.size());
+    for (auto& layer : layers) {
+        put_u32le(out, layer.size());
+        for (auto [x, y] : layer) {
+            put_u32le(out, x);
+            put_u32le(out, y);
+        }
+    }
+    return out;
+}
+
+
+static void
+write_frame(const render_options& options, u32 script, u32 step, const frame_layers& layers) {
+    if (options.format == frame_format::none) {
+        return;
+    }
+    bool png = options.format == frame_format::png;
+    auto data = png ? encode_png(layers) : encode_points(layers);
+
+    char name[64];
+    snprintf(name, sizeof(name), "s%03u_%04u.%s", script, step, png ? "png" : "pts");
+    auto fn = std::filesystem::path(options.output) / name;
+    FILE* fp = fopen(fn.c_str(), "wb");
+    if (fp == nullptr || fwrite(data.data(), 1, data.size(), fp) != data.size()) {
+        fprintf(stderr, "%s: write failed\n", fn.c_str());
+    }
+    if (fp != nullptr) {
+        fclose(fp);
+    }
+}
+
+
+static void
+render_script(const render_options& options, u32 index, const click_script& script, script_report& report) {
+    eval_stats = {};
+    path_compression = options.compression;
+
+    u32 size = 0;
+    const i64* image = machine_encode_result(make_nil(), &size);
+    std::vector<i64> state_image(image, image + size);
+    release_memory();
+
+    for (u32 step = 0; step < script.size(); ++step) {
+        auto mouse = script[step];
+        auto start = std::chrono::steady_clock::now();
 
         load_machine(nullptr);
         load_galaxy_machine();
 
-        expr* state = machine_decode_expr(side, scan_size-1);
-        expr* event = make_ap(make_ap(make_cons(), make_number(mouse[0])), make_number(mouse[1]));
+        expr* state = machine_decode_expr(state_image.data(), state_image.size() - 1, 1);
+        expr* event = make_ap(make_ap(make_cons(), make_number(mouse.first)), make_number(mouse.second));
         expr* call = make_ap(make_ap(make_atom(atom_kind::galaxy), state), event);
 
         expr* result = galaxy_eval(call);
@@ -979,19 +2005,158 @@ int main(int argc, char const *argv[]) {
         expr* new_state = result->r->l->r;
         expr* frames = result->r->r->l->r;
 
-#if 0
-        printf("flag: %lld\n", flag);
-        printf("state:\n");
-        print_encoded_array(new_state);
-        printf("frames:\n");
-        print_encoded_array(frames);
-#endif
-        side = machine_encode_result(new_state, &scan_size);
+        image = machine_encode_result(new_state, &size);
+        state_image.assign(image, image + size);
+        frame_layers layers;
+        if (flag == 0) {
+            read_layers(frames, layers);
+        }
+
+        release_memory();
+
+        std::chrono::duration<double, std::milli> elapsed = std::chrono::steady_clock::now() - start;
+        report.steps.push_back({mouse, flag, elapsed.count()});
+
+        // the galaxy wants a reply from the alien before the next click;
+        // feeding it a click instead would silently diverge
+        if (flag != 0) {
+            fprintf(stderr, "script %u step %u: galaxy sends to the alien, not supported offline; script stopped\n", index, step);
+            report.failed = 1;
+            break;
+        }
+        write_frame(options, index, step, layers);
+    }
+
+    load_machine(nullptr);
+    report.stats = eval_stats;
+}
+
+
+static void
+usage(const char* name) {
+    fprintf(stderr, "usage: %s [--boot] [-j N] [-o DIR] [-f png|points|none] [--no-compression] [FILE|- ...]\n", name);
+    fprintf(stderr, "  without FILE, renders the boot sequence\n");
+}
+
+
+int main(int argc, char const *argv[]) {
+    render_options options = {0, 1, 1, ".", frame_format::none};
+    std::vector<const char*> inputs;
+
+    for (int i = 1; i < argc; ++i) {
+        std::string arg = argv[i];
+        bool has_value = i + 1 < argc;
+        if (arg == "--boot") {
+            options.boot = 1;
+        }
+        else if (arg == "--no-compression") {
+            options.compression = 0;
+        }
+        else if (arg == "-j" && has_value) {
+            options.jobs = std::max(1, atoi(argv[++i]));
+        }
+        else if (arg == "-o" && has_value) {
+            options.output = argv[++i];
+        }
+        else if (arg == "-f" && has_value) {
+            std::string value = argv[++i];
+            if (value == "png") {
+                options.format = frame_format::png;
+            }
+            else if (value == "points") {
+                options.format = frame_format::points;
+            }
+            else if (value == "none") {
+                options.format = frame_format::none;
+            }
+            else {
+                usage(argv[0]);
+                return 2;
+            }
+        }
+        else if (arg == "-h" || arg == "--help" || (arg.size() > 1 && arg[0] == '-')) {
+            usage(argv[0]);
+            return 2;
+        }
+        else {
+            inputs.push_back(argv[i]);
+        }
+    }
 
-        mem_release(memory);
-        memory = nullptr;
+    std::vector<click_script> scripts;
+    for (auto* fn : inputs) {
+        if (!read_scripts(fn, scripts)) {
+            return 1;
+        }
+    }
+    if (inputs.empty()) {
+        scripts.push_back(boot_sequence);
+    }
+    else if (options.boot) {
+        for (auto& script : scripts) {
+            script.insert(script.begin(), boot_sequence.begin(), boot_sequence.end());
+        }
     }
 
+    if (options.format != frame_format::none) {
+        std::error_code error;
+        std::filesystem::create_directories(options.output, error);
+        if (error) {
+            fprintf(stderr, "%s: %s\n", options.output.c_str(), error.message().c_str());
+            return 1;
+        }
+    }
+
+    std::vector<script_report> reports(scripts.size());
+    std::atomic<u32> next = 0;
+    auto worker = [&] {
+        for (u32 i; (i = next++) < scripts.size();) {
+            render_script(options, i, scripts[i], reports[i]);
+        }
+    };
+
+    auto start = std::chrono::steady_clock::now();
+    std::vector<std::thread> threads;
+    for (u32 j = 1; j < std::min<size_t>(options.jobs, scripts.size()); ++j) {
+        threads.emplace_back(worker);
+    }
+    worker();
+    for (auto& t : threads) {
+        t.join();
+    }
+    std::chrono::duration<double, std::milli> wall = std::chrono::steady_clock::now() - start;
+
+    printf("script step      x      y flag       ms\n");
+    u64 steps = 0;
+    u32 failed = 0;
+    double total = 0;
+    eval_counters stats = {};
+    for (u32 i = 0; i < reports.size(); ++i) {
+        auto& report = reports[i];
+        for (u32 step = 0; step < report.steps.size(); ++step) {
+            auto& t = report.steps[step];
+            printf("%6u %4u %6d %6d %4lld %8.3f\n", i, step, t.mouse.first, t.mouse.second, (long long) t.flag, t.ms);
+            total += t.ms;
+        }
+        steps += report.steps.size();
+        failed += report.failed;
+        stats.reductions += report.stats.reductions;
+        stats.memo_hits += report.stats.memo_hits;
+        stats.compressed += report.stats.compressed;
+    }
+
+    printf("\n%zu scripts, %llu steps, %u jobs: step time %.3f ms, wall %.3f ms\n",
+        scripts.size(), (unsigned long long) steps, options.jobs, total, wall.count());
+    printf("path compression %s: reductions %llu, memo hits %llu, compressed %llu\n",
+        options.compression ? "on" : "off",
+        (unsigned long long) stats.reductions,
+        (unsigned long long) stats.memo_hits,
+        (unsigned long long) stats.compressed);
+
+    if (failed != 0) {
+        fprintf(stderr, "%u scripts stopped on alien requests\n", failed);
+        return 1;
+    }
     return 0;
 }
 #endif
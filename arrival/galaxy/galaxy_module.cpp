@@ -0,0 +1,448 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include "galaxy.cpp"
+
+
+// arrival._galaxy: libgalaxy as a CPython extension. Python lists and tuples
+// are converted to and from expr graphs directly, the same shapes
+// MachineImage.encode_lists and decode_lists produce, and the GIL is released
+// while the galaxy evaluates. Evaluator state is thread_local, so each Python
+// thread gets its own interpreter.
+
+typedef std::unordered_map<PyObject*, expr*> py_written;
+typedef std::unordered_map<expr*, PyObject*> py_decoded;
+
+
+static bool
+read_image(PyObject* obj, std::vector<i64>& image) {
+    Py_buffer view;
+    if (PyObject_CheckBuffer(obj) && PyObject_GetBuffer(obj, &view, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS) == 0) {
+        bool ok = view.itemsize == sizeof(i64) && view.format != nullptr
+            && (strcmp(view.format, "q") == 0 || strcmp(view.format, "l") == 0);
+        if (ok) {
+            auto* p = (const i64*) view.buf;
+            image.assign(p, p + view.len / sizeof(i64));
+        }
+        PyBuffer_Release(&view);
+        if (ok) {
+            return true;
+        }
+    }
+    PyErr_Clear();
+
+    PyObject* seq = PySequence_Fast(obj, "machine image must be a sequence of ints");
+    if (seq == nullptr) {
+        return false;
+    }
+    Py_ssize_t size = PySequence_Fast_GET_SIZE(seq);
+    PyObject** items = PySequence_Fast_ITEMS(seq);
+    image.resize(size);
+    for (Py_ssize_t i = 0; i < size; ++i) {
+        image[i] = PyLong_AsLongLong(items[i]);
+        if (image[i] == -1 && PyErr_Occurred()) {
+            Py_DECREF(seq);
+            return false;
+        }
+    }
+    Py_DECREF(seq);
+    return true;
+}
+
+
+static PyObject*
+image_to_list(const i64* image, u32 size) {
+    PyObject* res = PyList_New(size);
+    if (res == nullptr) {
+        return nullptr;
+    }
+    for (u32 i = 0; i < size; ++i) {
+        PyObject* x = PyLong_FromLongLong(image[i]);
+        if (x == nullptr) {
+            Py_DECREF(res);
+            return nullptr;
+        }
+        PyList_SET_ITEM(res, i, x);
+    }
+    return res;
+}
+
+
+// lists end in nil, tuples end in their last item; a list or tuple object
+// seen before is shared, as encode_lists(share=True) does with REF
+static expr*
+py_to_expr(PyObject* obj, py_written& written) {
+    if (PyLong_Check(obj)) {
+        i64 value = PyLong_AsLongLong(obj);
+        if (value == -1 && PyErr_Occurred()) {
+            return nullptr;
+        }
+        return make_number(value);
+    }
+
+    if (PyList_Check(obj) || PyTuple_Check(obj)) {
+        bool is_list = PyList_Check(obj);
+        Py_ssize_t size = is_list ? PyList_GET_SIZE(obj) : PyTuple_GET_SIZE(obj);
+        auto item = [&](Py_ssize_t i) {
+            return is_list ? PyList_GET_ITEM(obj, i) : PyTuple_GET_ITEM(obj, i);
+        };
+        if (is_list && size == 0) {
+            return make_nil();
+        }
+        if (!is_list && size < 2) {
+            if (size == 0) {
+                PyErr_SetString(PyExc_ValueError, "empty tuple has no galaxy value");
+                return nullptr;
+            }
+            return py_to_expr(item(0), written);
+        }
+
+        auto it = written.find(obj);
+        if (it != written.end()) {
+            return it->second;
+        }
+
+        Py_ssize_t end = is_list ? size : size - 1;
+        expr* tail = is_list ? make_nil() : py_to_expr(item(end), written);
+        if (tail == nullptr) {
+            return nullptr;
+        }
+        for (Py_ssize_t i = end; i-- > 0;) {
+            expr* head = py_to_expr(item(i), written);
+            if (head == nullptr) {
+                return nullptr;
+            }
+            tail = native_cons(head, tail);
+        }
+        written[obj] = tail;
+        return tail;
+    }
+
+    // MachineData, spliced as is
+    if (PyObject_HasAttrString(obj, "image")) {
+        PyObject* data = PyObject_GetAttrString(obj, "image");
+        std::vector<i64> image;
+        bool ok = data != nullptr && read_image(data, image);
+        Py_XDECREF(data);
+        if (!ok) {
+            return nullptr;
+        }
+        return machine_decode_expr(image.data(), image.size(), 1);
+    }
+
+    PyObject* number = PyNumber_Long(obj);
+    if (number == nullptr) {
+        return nullptr;
+    }
+    expr* res = py_to_expr(number, written);
+    Py_DECREF(number);
+    return res;
+}
+
+
+// cons chains ending in nil decode to lists, other chains to tuples
+static PyObject*
+expr_to_py(expr* e, py_decoded& decoded) {
+    switch (e->kind) {
+    case atom_kind::number:
+        return PyLong_FromLongLong(e->number);
+
+    case atom_kind::nil:
+        return PyList_New(0);
+
+    case atom_kind::ap:
+        if (is_cons_cell(e)) {
+            break;
+        }
+        [[fallthrough]];
+
+    default:
+        PyErr_Format(PyExc_ValueError, "galaxy value is not data (token %d)", int(e->kind));
+        return nullptr;
+    }
+
+    auto it = decoded.find(e);
+    if (it != decoded.end()) {
+        Py_INCREF(it->second);
+        return it->second;
+    }
+
+    std::vector<PyObject*> items;
+    auto release = [&] {
+        for (auto* x : items) {
+            Py_DECREF(x);
+        }
+    };
+    expr* tail = e;
+    for (; is_cons_cell(tail); tail = tail->r) {
+        PyObject* head = expr_to_py(tail->l->r, decoded);
+        if (head == nullptr) {
+            release();
+            return nullptr;
+        }
+        items.push_back(head);
+    }
+
+    bool is_list = true;
+    if (tail->kind != atom_kind::nil) {
+        PyObject* last = expr_to_py(tail, decoded);
+        if (last == nullptr) {
+            release();
+            return nullptr;
+        }
+        if (PyList_Check(last) || PyTuple_Check(last)) {
+            is_list = PyList_Check(last);
+            PyObject* seq = PySequence_Fast(last, "");
+            Py_ssize_t size = PySequence_Fast_GET_SIZE(seq);
+            for (Py_ssize_t i = 0; i < size; ++i) {
+                PyObject* x = PySequence_Fast_GET_ITEM(seq, i);
+                Py_INCREF(x);
+                items.push_back(x);
+            }
+            Py_DECREF(seq);
+            Py_DECREF(last);
+        }
+        else {
+            is_list = false;
+            items.push_back(last);
+        }
+    }
+
+    PyObject* res = is_list ? PyList_New(items.size()) : PyTuple_New(items.size());
+    if (res == nullptr) {
+        release();
+        return nullptr;
+    }
+    for (size_t i = 0; i < items.size(); ++i) {
+        if (is_list) {
+            PyList_SET_ITEM(res, i, items[i]);
+        }
+        else {
+            PyTuple_SET_ITEM(res, i, items[i]);
+        }
+    }
+
+    Py_INCREF(res);
+    decoded[e] = res;
+    return res;
+}
+
+
+static PyObject*
+expr_to_value(expr* e) {
+    py_decoded decoded;
+    PyObject* res = expr_to_py(e, decoded);
+    for (auto& [_, x] : decoded) {
+        Py_DECREF(x);
+    }
+    return res;
+}
+
+
+static PyObject*
+expr_to_image(expr* e) {
+    u32 size = 0;
+    i64* image = machine_encode_result(e, &size);
+    return image_to_list(image, size - 1);
+}
+
+
+PyDoc_STRVAR(galaxy_evaluate_doc,
+"evaluate(state, event, raw_data=False, raw_images=False) -> [flag, new_state, data]\n\n"
+"Runs one galaxy interaction on a fresh galaxy machine. With raw_data,\n"
+"data for the alien (flag != 0) is returned as a machine image, with\n"
+"raw_images so are the frame images (flag == 0).");
+
+static PyObject*
+galaxy_evaluate(PyObject* self, PyObject* args, PyObject* kwargs) {
+    static const char* keywords[] = {"state", "event", "raw_data", "raw_images", nullptr};
+    PyObject* state_obj = nullptr;
+    PyObject* event_obj = nullptr;
+    int raw_data = 0;
+    int raw_images = 0;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO|pp", (char**) keywords, &state_obj, &event_obj, &raw_data, &raw_images)) {
+        return nullptr;
+    }
+
+    load_machine(nullptr);
+    load_galaxy_machine();
+
+    py_written written;
+    expr* state = py_to_expr(state_obj, written);
+    expr* event = (state != nullptr) ? py_to_expr(event_obj, written) : nullptr;
+    if (event == nullptr) {
+        release_memory();
+        return nullptr;
+    }
+    expr* call = make_ap(make_ap(make_atom(atom_kind::galaxy), state), event);
+
+    expr* result;
+    Py_BEGIN_ALLOW_THREADS
+    result = galaxy_eval(call);
+    Py_END_ALLOW_THREADS
+
+    PyObject* res;
+    i64 flag = as_number(result->l->r);
+    if ((raw_data && flag != 0) || (raw_images && flag == 0)) {
+        PyObject* new_state = expr_to_value(result->r->l->r);
+        PyObject* data = (new_state != nullptr) ? expr_to_image(result->r->r->l->r) : nullptr;
+        res = (data != nullptr) ? Py_BuildValue("[LNN]", (long long) flag, new_state, data) : nullptr;
+        if (res == nullptr) {
+            Py_XDECREF(new_state);
+            Py_XDECREF(data);
+        }
+    }
+    else {
+        res = expr_to_value(result);
+    }
+
+    release_memory();
+    return res;
+}
+
+
+PyDoc_STRVAR(galaxy_evaluate_image_doc,
+"evaluate_image(image) -> image\n\n"
+"Evaluates a machine image on the loaded machine, result as a machine image.\n"
+"The machine stays loaded, calls leave its rom as they found it.");
+
+static PyObject*
+galaxy_evaluate_image(PyObject* self, PyObject* arg) {
+    std::vector<i64> request;
+    if (!read_image(arg, request)) {
+        return nullptr;
+    }
+
+    if (machine == nullptr) {
+        load_galaxy_machine();
+    }
+
+    expr* e = machine_decode_expr(request.data(), request.size(), 1);
+
+    expr* result;
+    Py_BEGIN_ALLOW_THREADS
+    result = galaxy_eval(e);
+    Py_END_ALLOW_THREADS
+
+    PyObject* res = expr_to_image(result);
+    release_memory();
+    return res;
+}
+
+
+PyDoc_STRVAR(galaxy_load_machine_doc,
+"load_machine(image=None)\n\n"
+"Loads a machine image; None unloads, and the galaxy is loaded on next use.");
+
+static PyObject*
+galaxy_load_machine(PyObject* self, PyObject* args) {
+    PyObject* arg = Py_None;
+    if (!PyArg_ParseTuple(args, "|O", &arg)) {
+        return nullptr;
+    }
+    if (arg == Py_None) {
+        load_machine(nullptr);
+        Py_RETURN_NONE;
+    }
+
+    std::vector<i64> image;
+    if (!read_image(arg, image)) {
+        return nullptr;
+    }
+    load_machine(image.data());
+    Py_RETURN_NONE;
+}
+
+
+PyDoc_STRVAR(galaxy_modulate_doc,
+"modulate(image) -> bytes\n\n"
+"Alien wire format of a machine image.");
+
+static PyObject*
+galaxy_modulate(PyObject* self, PyObject* arg) {
+    std::vector<i64> image;
+    if (!read_image(arg, image)) {
+        return nullptr;
+    }
+    expr* e = machine_decode_expr(image.data(), image.size(), 1);
+    PyObject* res = PyBytes_FromString(encode(e));
+    release_memory();
+    return res;
+}
+
+
+PyDoc_STRVAR(galaxy_demodulate_doc,
+"demodulate(text) -> image\n\n"
+"Machine image of an alien response; ValueError if it does not parse.");
+
+static PyObject*
+galaxy_demodulate(PyObject* self, PyObject* arg) {
+    const char* text = PyBytes_AsString(arg);
+    if (text == nullptr) {
+        return nullptr;
+    }
+    expr* e = decode(text);
+    PyObject* res = (e != nullptr) ? expr_to_image(e) : PyErr_Format(PyExc_ValueError, "bad alien response %R", arg);
+    release_memory();
+    return res;
+}
+
+
+PyDoc_STRVAR(galaxy_native_mode_doc,
+"native_mode(mode)\n\n"
+"Native galaxy function overrides for the calling thread: 0 off, 1 on,\n"
+"2 verify against the interpreter.");
+
+static PyObject*
+galaxy_native_mode_py(PyObject* self, PyObject* arg) {
+    long mode = PyLong_AsLong(arg);
+    if (mode == -1 && PyErr_Occurred()) {
+        return nullptr;
+    }
+    if (mode < 0 || mode > 2) {
+        return PyErr_Format(PyExc_ValueError, "bad native mode %ld", mode);
+    }
+    galaxy_native_mode(mode);
+    Py_RETURN_NONE;
+}
+
+
+PyDoc_STRVAR(galaxy_eval_stats_doc,
+"eval_stats() -> (reductions, memo_hits, compressed, arena_bytes)\n\n"
+"Evaluator counters of the calling thread, cumulative.");
+
+static PyObject*
+galaxy_eval_stats(PyObject* self, PyObject* unused) {
+    return Py_BuildValue("(KKKK)",
+        (unsigned long long) eval_stats.reductions,
+        (unsigned long long) eval_stats.memo_hits,
+        (unsigned long long) eval_stats.compressed,
+        (unsigned long long) eval_stats.arena_bytes);
+}
+
+
+static PyMethodDef galaxy_methods[] = {
+    {"evaluate", (PyCFunction)(void(*)(void)) galaxy_evaluate, METH_VARARGS | METH_KEYWORDS, galaxy_evaluate_doc},
+    {"evaluate_image", galaxy_evaluate_image, METH_O, galaxy_evaluate_image_doc},
+    {"load_machine", galaxy_load_machine, METH_VARARGS, galaxy_load_machine_doc},
+    {"modulate", galaxy_modulate, METH_O, galaxy_modulate_doc},
+    {"demodulate", galaxy_demodulate, METH_O, galaxy_demodulate_doc},
+    {"native_mode", galaxy_native_mode_py, METH_O, galaxy_native_mode_doc},
+    {"eval_stats", galaxy_eval_stats, METH_NOARGS, galaxy_eval_stats_doc},
+    {nullptr, nullptr, 0, nullptr},
+};
+
+
+static struct PyModuleDef galaxy_module = {
+    PyModuleDef_HEAD_INIT,
+    "_galaxy",
+    "Galaxy evaluator (libgalaxy) as a CPython extension.",
+    -1,
+    galaxy_methods,
+};
+
+
+PyMODINIT_FUNC
+PyInit__galaxy() {
+    return PyModule_Create(&galaxy_module);
+}
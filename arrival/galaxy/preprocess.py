@@ -1,90 +1,183 @@
 #!/usr/bin/env python
 import io
-import itertools
 import sys
+from array import array
 from arrival import MachineImage
 
 
-class Preprocessor:
-    def parses(self, text):
-        with io.StringIO(text) as fp:
-            return self.parse(fp)
+class PreprocessError(Exception):
+    def __init__(self, message, fn=None, line=None):
+        super().__init__(message)
+        self.message = message
+        self.fn = fn
+        self.line = line
 
-    def parse(self, fp):
-        tokens = MachineImage.TOKENS
+    def __str__(self):
+        where = ':'.join(str(x) for x in (self.fn, self.line) if x is not None)
+        return f'{where}: {self.message}' if where else self.message
 
-        def ser(t):
-            if t.startswith(':') and t[1:].isdigit():
-                return [tokens['FUN'], int(t[1:], 10)]
-            elif t.isdigit() or (t.startswith('-') and t[1:].isdigit()):
-                return [tokens['number'], int(t, 10)]
-            elif t == '=':
-                return [tokens['DEF']]
-            elif t == 'galaxy':
-                return [tokens['galaxy'], 0]
-            return [tokens[t]]
 
-        machine = list()
-        for ln in fp:
-            xs = [x for p in map(ser, ln.split()) for x in p]
-            s = [tokens['SCAN'], len(xs)] + xs
-            machine += s
+class ListSink:
+    def __init__(self):
+        self.machine = array('q')
 
-        machine.append(tokens["GG"])
+    def begin(self, tokens):
+        pass
 
-        return tokens, machine
+    def line(self, xs, is_def):
+        self.machine.extend(xs)
 
+    def end(self, gg):
+        self.machine.append(gg)
 
-class Printer:
+
+class IncSink:
+    # same layout as before: one row per definition, blank lines trail the
+    # previous row
     def __init__(self, fp):
         self.fp = fp
 
-    def write(self, *args, **kwargs):
-        print(*args, file=self.fp, **kwargs)
+    def begin(self, tokens):
+        enum = '\n'.join(f'    {k} = {v},' for k, v in tokens.items())
+        self.fp.write('// preprocess.py galaxy.txt > galaxy_machine.inc\n\n'
+            f'enum class atom_kind : uint8_t {{\n{enum}\n}};\n\n'
+            'static const int64_t\ngalaxy_machine_image[] = {')
+
+    def line(self, xs, is_def):
+        row = ', '.join(map(str, xs))
+        self.fp.write(f'\n    {row}, ' if is_def else f'{row}, ')
 
-    def format(self, machine, tokens):
-        self.write('// preprocess.py galaxy.txt > galaxy_machine.inc')
-        self.write()
+    def end(self, gg):
+        self.fp.write(f'\n    {gg},\n}};\n')
 
-        self.write('enum class atom_kind : uint8_t {')
-        s = '\n'.join(f'    {k} = {v},' for k,v in tokens.items())
-        self.write(s)
-        self.write('};')
-        self.write()
 
-        scan, fun, df, galaxy = tokens['SCAN'], tokens['FUN'], tokens['DEF'], tokens['galaxy']
+class BinSink:
+    # int64 little-endian, flushed in blocks
+    def __init__(self, fp, block=1 << 16):
+        self.fp = fp
+        self.block = block
+        self.buf = array('q')
+
+    def begin(self, tokens):
+        pass
 
-        self.write('static const int64_t')
-        self.write('galaxy_machine_image[] = {', end='')
+    def flush(self):
+        if sys.byteorder != 'little':
+            self.buf.byteswap()
+        self.fp.write(self.buf.tobytes())
+        self.buf = array('q')
 
-        for i, x in enumerate(machine[:-1]):
-            if (x == scan) and (i + 5 < len(machine)):
-                if ((machine[i+2] == fun) or (machine[i+2] == galaxy)) and (machine[i+4] == df):
-                    self.write()
-                    self.write('    ', end='')
-            self.write(str(x), end=', ')
+    def line(self, xs, is_def):
+        self.buf.extend(xs)
+        if len(self.buf) >= self.block:
+            self.flush()
 
-        self.write()
-        self.write(f'    {machine[-1]},')
-        self.write('};')
+    def end(self, gg):
+        self.buf.append(gg)
+        self.flush()
 
 
-def preprocess(fn='galaxy.txt'):
-    fp = sys.stdin if fn == '-' else open(fn)
+class Preprocessor:
+    def __init__(self):
+        self.tokens = MachineImage.TOKENS
+        t = self.tokens
+        self.scan, self.fun, self.number, self.df, self.galaxy = t['SCAN'], t['FUN'], t['number'], t['DEF'], t['galaxy']
+        # REF only appears in call images, the rom loader rejects it
+        self.atoms = {k: v for k, v in t.items() if k not in ('SCAN', 'FUN', 'number', 'DEF', 'galaxy', 'GG', 'REF')}
+
+    def parses(self, text):
+        with io.StringIO(text) as fp:
+            return self.parse(fp)
+
+    def parse(self, fp, fn=None):
+        sink = ListSink()
+        self.compile(fp, sink, fn=fn)
+        return self.tokens, list(sink.machine)
+
+    def compile(self, fp, sink, fn=None):
+        atoms, fun, number = self.atoms, self.fun, self.number
+        defined = set()
+        used = dict()
+
+        def fail(message, lineno):
+            raise PreprocessError(message, fn=fn, line=lineno)
+
+        sink.begin(self.tokens)
+        for lineno, ln in enumerate(fp, 1):
+            ts = ln.split()
+            if not ts:
+                sink.line((self.scan, 0), False)
+                continue
+            if len(ts) < 3 or ts[1] != '=':
+                fail(f'expected "name = expr": {ln.strip()[:40]!r}', lineno)
+
+            name = ts[0]
+            if name == 'galaxy':
+                head = (self.galaxy, 0)
+            elif name[0] == ':' and name[1:].isdigit():
+                head = (fun, int(name[1:]))
+            else:
+                fail(f'bad definition name {name!r}', lineno)
+            if name in defined:
+                fail(f'{name} redefined', lineno)
+            defined.add(name)
+
+            xs = array('q', head)
+            xs.append(self.df)
+            for t in ts[2:]:
+                if (x := atoms.get(t)) is not None:
+                    xs.append(x)
+                elif t[0] == ':' and t[1:].isdigit():
+                    xs.append(fun)
+                    xs.append(int(t[1:]))
+                    used.setdefault(t, lineno)
+                elif t.isdigit() or (t[0] == '-' and t[1:].isdigit()):
+                    xs.append(number)
+                    xs.append(int(t))
+                elif t == 'galaxy':
+                    xs.append(self.galaxy)
+                    xs.append(0)
+                    used.setdefault(t, lineno)
+                else:
+                    fail(f'unknown token {t!r}', lineno)
+
+            sink.line(array('q', (self.scan, len(xs))) + xs, True)
+
+        undefined = sorted(set(used) - defined, key=used.get)
+        if undefined:
+            fail('undefined ' + ', '.join(f'{t} (line {used[t]})' for t in undefined), used[undefined[0]])
+        sink.end(self.tokens['GG'])
+
+
+def preprocess(fn='galaxy.txt', out='-', format='inc'):
+    # compiled in memory so a rejected galaxy leaves no partial output
+    buf = io.StringIO() if format == 'inc' else io.BytesIO()
+    sink = IncSink(buf) if format == 'inc' else BinSink(buf)
+    fin = sys.stdin if fn == '-' else open(fn)
     try:
-        preproc = Preprocessor()
-        tokens, machine = preproc.parse(fp)
+        Preprocessor().compile(fin, sink, fn='<stdin>' if fn == '-' else fn)
     finally:
-        if fn != '-': fp.close()
+        if fn != '-': fin.close()
 
-    printer = Printer(sys.stdout)
-    printer.format(machine, tokens)
+    if out == '-':
+        fout = sys.stdout if format == 'inc' else sys.stdout.buffer
+        fout.write(buf.getvalue())
+    else:
+        with open(out, 'w' if format == 'inc' else 'wb') as fout:
+            fout.write(buf.getvalue())
 
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
     a = parser.add_argument('galaxy', metavar='galaxy.txt')
+    a = parser.add_argument('-o', '--output', default='-', help='Output file, default stdout')
+    a = parser.add_argument('-f', '--format', choices=['inc', 'bin'], help='C++ include or int64 little-endian image, default by output suffix')
     args = parser.parse_args()
 
-    preprocess(args.galaxy)
+    format = args.format or ('bin' if args.output.endswith('.bin') else 'inc')
+    try:
+        preprocess(args.galaxy, out=args.output, format=format)
+    except PreprocessError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import ctypes
+import sys
+from arrival import MachineImage
+from arrival.galaxy import BOOT_SEQUENCE, Galaxy, LocalAlienProxy
+from pathlib import Path
+
+
+class Profile:
+    def __init__(self, dump):
+        it = iter(dump)
+        kinds = next(it)
+        self.reductions = [next(it) for _ in range(kinds)]
+        self.memo_hits = next(it)
+        self.memo_misses = next(it)
+        self.alloc_bytes = next(it)
+        self.functions = dict()
+        for _ in range(next(it)):
+            fun, calls, reductions, nbytes = next(it), next(it), next(it), next(it)
+            self.functions[fun] = (calls, reductions, nbytes)
+
+
+class Profiler:
+    def __init__(self, target='profile'):
+        self.galaxy = Galaxy(target=target, alien=LocalAlienProxy(lambda data: [0]))
+        lib = self.galaxy.galexy.lib
+        lib.galaxy_profile.argtypes = (ctypes.POINTER(ctypes.c_uint32),)
+        lib.galaxy_profile.restype = ctypes.POINTER(ctypes.c_int64)
+        lib.galaxy_profile_reset.argtypes = ()
+        lib.galaxy_profile_reset.restype = None
+        self.lib = lib
+
+    def reset(self):
+        self.lib.galaxy_profile_reset()
+
+    def collect(self):
+        size = ctypes.c_uint32(0)
+        dump = self.lib.galaxy_profile(ctypes.byref(size))
+        if not dump:
+            raise Exception('libgalaxy built without GALAXY_PROFILE')
+        return Profile(dump[:size.value])
+
+
+def load_definitions(fn):
+    defs = dict()
+    with open(fn) as fp:
+        for ln in fp:
+            tokens = ln.split()
+            if len(tokens) > 2:
+                name = 0 if tokens[0] == 'galaxy' else int(tokens[0][1:])
+                defs[name] = ' '.join(tokens[2:])
+    return defs
+
+
+def report(profile, defs, top=30, fp=sys.stdout):
+    kinds = {v: k for k, v in MachineImage.TOKENS.items()}
+    total = sum(profile.reductions)
+    print(f'reductions: {total}', file=fp)
+    for kind, n in sorted(enumerate(profile.reductions), key=lambda x: -x[1]):
+        if n:
+            print(f'  {kinds.get(kind, kind):>8} {n:>12} {100 * n / total:6.2f}%', file=fp)
+
+    lookups = profile.memo_hits + profile.memo_misses
+    rate = (100 * profile.memo_hits / lookups) if lookups else 0
+    print(f'memo: {profile.memo_hits} hits / {lookups} ap lookups ({rate:.1f}%)', file=fp)
+    print(f'allocated: {profile.alloc_bytes} bytes', file=fp)
+
+    print(f'functions by reductions (top {top}):', file=fp)
+    print(f'  {"name":>8} {"calls":>10} {"reductions":>12} {"bytes":>12}  definition', file=fp)
+    rows = sorted(profile.functions.items(), key=lambda x: -x[1][1])[:top]
+    for fun, (calls, reductions, nbytes) in rows:
+        name = {0: 'galaxy', -1: '(input)'}.get(fun, f':{fun}')
+        text = defs.get(fun, '')
+        text = text if len(text) < 60 else text[:57] + '...'
+        print(f'  {name:>8} {calls:>10} {reductions:>12} {nbytes:>12}  {text}', file=fp)
+
+
+def main(galaxy_txt, trace=None, target='profile', top=30):
+    profiler = Profiler(target=target)
+    galaxy = profiler.galaxy
+    profiler.reset()
+
+    if trace:
+        from arrival.session import load_steps
+        for step in load_steps(trace):
+            galaxy.alien = LocalAlienProxy(step.responses)
+            galaxy._interact(step.state, step.event)
+    else:
+        for mouse in BOOT_SEQUENCE:
+            galaxy.state, _ = galaxy._interact(galaxy.state, mouse)
+
+    report(profiler.collect(), load_definitions(galaxy_txt), top=top)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('galaxy', metavar='galaxy.txt', nargs='?',
+        default=str(Path(__file__).parent / '../../spec/galaxy.txt'))
+    parser.add_argument('-s', '--session', metavar='TRACE', help='Replay recorded session instead of boot sequence')
+    parser.add_argument('-t', '--build-target', metavar='TARGET', default='profile')
+    parser.add_argument('-n', '--top', type=int, default=30)
+    args = parser.parse_args()
+
+    main(args.galaxy, trace=args.session, target=args.build_target, top=args.top)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+import math
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from arrival import MachineImage
+from compare import Case, NativeEngine, PythonEngine
+
+
+# synthetic programs in galaxy.txt format, written as spec test cases with
+# expected results from the reference evaluator (galaxy_too_deep); programs
+# are built as lambda terms and compiled to s, b, c, t, i by bracket abstraction
+
+class Var:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+def ap(f, *args):
+    for x in args:
+        f = (f, x)
+    return f
+
+
+def lam(*params):
+    # lam(x, y)(body) compiles \x y. body
+    def build(body):
+        for x in reversed(params):
+            body = abstract(x, body)
+        return body
+    return build
+
+
+def occurs(x, term):
+    fringe = [term]
+    while fringe:
+        t = fringe.pop()
+        if t is x:
+            return True
+        if isinstance(t, tuple):
+            fringe.extend(t)
+    return False
+
+
+def abstract(x, term):
+    if term is x:
+        return 'i'
+    if not occurs(x, term):
+        return ('t', term)
+    f, arg = term
+    if arg is x and not occurs(x, f):
+        return f
+    if not occurs(x, f):
+        return ap('b', f, abstract(x, arg))
+    if not occurs(x, arg):
+        return ap('c', abstract(x, f), arg)
+    return ap('s', abstract(x, f), abstract(x, arg))
+
+
+def emit(term):
+    tokens = list()
+    fringe = [term]
+    while fringe:
+        t = fringe.pop()
+        if isinstance(t, tuple):
+            tokens.append('ap')
+            fringe.append(t[1])
+            fringe.append(t[0])
+        elif isinstance(t, Var):
+            raise Exception(('free variable', t))
+        else:
+            tokens.append(str(t))
+    return ' '.join(tokens)
+
+
+def literal_list(xs):
+    res = 'nil'
+    for x in reversed(xs):
+        res = ap('cons', x, res)
+    return res
+
+
+def if_then(cond, then, otherwise):
+    return ap(cond, then, otherwise)
+
+
+def recursion(size, rng):
+    # non-tail recursive sum n + (n-1) + ... + 0, size deep
+    k = Var('k')
+    fun = ':1000'
+    body = if_then(ap('eq', 0, k), 0, ap('add', k, ap(fun, ap('add', k, -1))))
+    x = Var('x')
+    return {fun: lam(k)(body), 'galaxy': lam(x)(ap(fun, x))}, size
+
+
+def lists(size, rng):
+    # maps add x over a literal list of size numbers
+    x, l = Var('x'), Var('l')
+    data, fun = ':1001', ':1002'
+    body = if_then(ap('isnil', l), 'nil', ap('cons', ap('add', x, ap('car', l)), ap(fun, x, ap('cdr', l))))
+    items = [rng.randint(-1000, 1000) for _ in range(size)]
+    return {data: literal_list(items), fun: lam(x, l)(body), 'galaxy': lam(x)(ap(fun, x, data))}, 7
+
+
+def tree(size, rng):
+    # arithmetic over two arguments with size leaves; abstraction turns it
+    # into a wide s, b, c tree
+    x, y = Var('x'), Var('y')
+    def build(n):
+        if n == 1:
+            return rng.choice([x, y, x, y, rng.randint(-9, 9)])
+        left = max(1, min(n - 1, n // 2 + rng.randint(-n // 8, n // 8)))
+        a, b = build(left), build(n - left)
+        op = rng.random()
+        if op < 0.5:
+            return ap('add', a, b)
+        if op < 0.7:
+            return ap('mul', rng.choice([-1, 1, 2]), ap('add', a, b))
+        if op < 0.85:
+            return ap('neg', ap('add', a, b))
+        p, q = Var('p'), Var('q')
+        return ap(lam(p, q)(if_then(ap('lt', p, q), p, q)), a, b)
+    return {'galaxy': lam(x, y)(build(size))}, (3, -5)
+
+
+def bigint(size, rng):
+    # alternating sums of values near 2^60, scaled by mul and div
+    x, l = Var('x'), Var('l')
+    data, fun = ':1003', ':1004'
+    base = 2 ** 60
+    items = [(base + rng.randint(0, 2 ** 40)) * (-1) ** i for i in range(size)]
+    body = if_then(ap('isnil', l), 0, ap('add', ap('car', l), ap(fun, ap('cdr', l))))
+    galaxy = lam(x)(ap('div', ap('mul', ap('add', x, ap(fun, data)), 3), 3))
+    return {data: literal_list(items), fun: lam(l)(body), 'galaxy': galaxy}, 1
+
+
+Families = {
+    'recursion': recursion,
+    'list': lists,
+    'tree': tree,
+    'bigint': bigint,
+}
+
+
+class _Program:
+    def __init__(self, code, params):
+        self.code = code
+        self.params = params if isinstance(params, tuple) else (params,)
+
+
+def generate(family, size, seed=0):
+    rng = random.Random(f'{family}-{size}-{seed}')
+    defs, params = Families[family](size, rng)
+    code = ''.join(f'{name} = {emit(term)}\n' for name, term in defs.items())
+    return code, params
+
+
+def write_corpus(out, families, sizes, seed=0):
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    reference = PythonEngine()
+    for family in families:
+        for size in sizes:
+            code, params = generate(family, size, seed=seed)
+            start = time.perf_counter()
+            expect = reference.case(_Program(code, params))
+            elapsed = time.perf_counter() - start
+            fn = out / f'stress-{family}-{size}.txt'
+            with open(fn, 'w') as fp:
+                fp.write(code)
+                fp.write('---\n')
+                fp.write(f'params = {params!r}\n')
+                fp.write(f'expect = {expect!r}\n')
+                fp.write(f'family = {family}\n')
+                fp.write(f'size = {size}\n')
+            print(f'{fn}: {len(code)} bytes, reference {elapsed:.3f}s')
+
+
+def read_meta(fn):
+    meta = dict()
+    for s in Path(fn).read_text().split('---')[1].splitlines():
+        ps = s.split('=')
+        if len(ps) == 2:
+            meta[ps[0].strip()] = ps[1].strip()
+    return meta['family'], int(meta['size'])
+
+
+def _growth(a, b, sa, sb):
+    if a <= 0 or b <= 0 or sa == sb:
+        return ''
+    k = math.log(b / a) / math.log(sb / sa)
+    return f'{k:.2f}' + ('!' if k > 1.2 else '')
+
+
+def _measure(name, engine, case):
+    # memory is arena bytes for libgalaxy and the traced python peak for the
+    # reference, taken in a run of its own
+    if name == 'native':
+        arena = engine.lib.eval_stats()[3]
+        engine.case(case)
+        return engine.lib.eval_stats()[3] - arena
+    tracemalloc.start()
+    engine.case(case)
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return memory
+
+
+def bench(corpus, engines, runs=3, fp=sys.stdout):
+    # growth is the exponent of reductions and of time against size between
+    # neighbouring sizes; ! marks super-linear steps
+    cases = sorted(((read_meta(fn), Case(fn)) for fn in Path(corpus).glob('stress-*.txt')), key=lambda x: x[0])
+    print(f'{"engine":>16} {"family":>10} {"size":>7} {"time":>10} {"reductions":>12} {"memory":>10} {"r-growth":>8} {"t-growth":>8}', file=fp)
+    for name in engines:
+        engine = {'native': NativeEngine, 'python': PythonEngine}[name]()
+        last = None
+        for (family, size), case in cases:
+            best = None
+            for _ in range(runs):
+                before = engine.reductions()
+                start = time.perf_counter()
+                res = engine.case(case)
+                elapsed = time.perf_counter() - start
+                reductions = engine.reductions() - before
+                best = min(best or elapsed, elapsed)
+            memory = _measure(name, engine, case)
+            if MachineImage().encode_lists(res) != MachineImage().encode_lists(case.expect):
+                print(f'{case.name}: {engine.name} differs from reference', file=sys.stderr)
+            rg = tg = ''
+            if last and last[0] == family:
+                rg = _growth(last[2], reductions, last[1], size)
+                tg = _growth(last[3], best, last[1], size)
+            last = (family, size, reductions, best)
+            print(f'{engine.name:>16} {family:>10} {size:>7} {best * 1000:>8.2f}ms {reductions:>12} {memory / 1024:>8.0f}KB {rg:>8} {tg:>8}', file=fp)
+
+
+def _in_thread(fn, *args, **kwargs):
+    # the reference evaluator and deep programs recurse deeply
+    sys.setrecursionlimit(1000000)
+    threading.stack_size(0x10000000)
+    t = threading.Thread(target=fn, args=args, kwargs=kwargs)
+    t.start()
+    t.join()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate and benchmark synthetic galaxy programs')
+    parser.add_argument('command', choices=['generate', 'bench'])
+    parser.add_argument('corpus', help='Corpus directory')
+    parser.add_argument('-f', '--family', action='append', choices=list(Families), help='Program families, default all')
+    parser.add_argument('-n', '--size', type=int, action='append', help='Program sizes, default 16 64 256 1024')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-e', '--engine', action='append', choices=['native', 'python'], help='Evaluators to bench, default native')
+    parser.add_argument('-r', '--runs', type=int, default=3, help='Runs per case, best time is reported')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        _in_thread(write_corpus, args.corpus, args.family or list(Families), args.size or [16, 64, 256, 1024], seed=args.seed)
+    else:
+        _in_thread(bench, args.corpus, args.engine or ['native'], runs=args.runs)
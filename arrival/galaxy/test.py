@@ -1,5 +1,4 @@
 #!/usr/bin/env python
-import ctypes
 import io
 import subprocess
 import sys
@@ -9,31 +8,21 @@ from pathlib import Path
 
 
 class Galaxy:
-    def __init__(self, target='release'):
+    def __init__(self):
+        from arrival import _galaxy
         self.state = []
-        fn = 'libgalaxy' + ('.dylib' if sys.platform == 'darwin' else '.so')
-        build_target = (target + '/') if target else ''
-        fn = next(Path(__file__).parent.glob('**/' + build_target + fn))
-        self.galexy = ctypes.cdll.LoadLibrary(fn)
-        p64 = ctypes.POINTER(ctypes.c_int64)
-        u32 = ctypes.c_uint32
-        self.galexy.evaluate.argtypes = (u32, p64)
-        self.galexy.evaluate.restype = p64
-        self.galexy.load_machine.argtypes = (p64,)
-        self.galexy.load_machine.restype = None
+        self.galexy = _galaxy
 
     def load_machine(self, image):
         # print('machine', repr(image))
-        data = (ctypes.c_int64 * len(image))(*image)
-        self.galexy.load_machine(data)
+        self.galexy.load_machine(image)
 
     def eval(self, *args):
         # print('galaxy', repr(args))
         image = MachineImage().emit_call('galaxy', *args)
         # print('  ', repr(image))
-        data = (ctypes.c_int64 * len(image))(*image)
-        res = self.galexy.evaluate(len(image), data)
-        res = MachineImage().decode_lists(res)
+        res = self.galexy.evaluate_image(image)
+        res = MachineImage().decode_lists(res + [MachineImage.TOKENS['GG']])
         # print('  =', repr(res))
         return res
 
@@ -58,13 +47,13 @@ def preprocess(fn):
     return machine, param, expect
 
 
-def build(target):
-    r = subprocess.run(['make', 'test', f'TEST_TARGET={target}'], stdout=subprocess.DEVNULL)
+def build():
+    r = subprocess.run([sys.executable, 'setup.py', 'build_ext', '--inplace'], cwd=Path(__file__).parent.parent, stdout=subprocess.DEVNULL)
     r.check_returncode()
 
 
-def execute(machine, args, target):
-    g = Galaxy(target=target)
+def execute(machine, args):
+    g = Galaxy()
     g.load_machine(machine)
     if not isinstance(args, tuple):
         args = (args,)
@@ -75,28 +64,28 @@ def execute(machine, args, target):
     return a
 
 
-def test_one(fn, target):
+def test_one(fn):
     machine, args, expects = preprocess(fn)
-    results = execute(machine, args, target=target)
+    results = execute(machine, args)
     assert results == expects, (results, expects)
 
 
-def main(fn=None, evaluate=None, scan=None, target='debug'):
+def main(fn=None, evaluate=None, scan=None):
     if evaluate:
         args = eval(evaluate)
-        g = Galaxy(target=target)
+        g = Galaxy()
         results = g.eval(args)
         # print(repr(results))
 
     if fn:
-        build(target=target)
-        test_one(fn, target=target)
+        build()
+        test_one(fn)
 
     if scan:
-        build(target=target)
+        build()
         for fn in Path(scan).glob('*.txt'):
             print(fn)
-            test_one(fn, target=target)
+            test_one(fn)
 
 
 if __name__ == '__main__':
@@ -105,12 +94,10 @@ if __name__ == '__main__':
     parser.add_argument('--test', help='Test file')
     parser.add_argument('--eval', metavar='ARG')
     parser.add_argument('-d', '--scan', help='All tests in directory')
-    parser.add_argument('-t', '--build-target', metavar='TARGET', default='debug')
     args = parser.parse_args()
 
     main(
         fn=args.test,
         evaluate=args.eval,
         scan=args.scan,
-        target=args.build_target
     )
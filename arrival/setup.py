@@ -1,9 +1,18 @@
-from setuptools import setup
+from setuptools import Extension, setup
+
+galaxy = Extension(
+    'arrival._galaxy',
+    sources=['galaxy/galaxy_module.cpp'],
+    depends=['galaxy/galaxy.cpp', 'galaxy/galaxy_machine.inc'],
+    extra_compile_args=['-std=c++17', '-O2'],
+    language='c++',
+)
 
 setup(
    name='Arrival',
    version='1.0',
    description='ICFPC 2020 Arrival',
    author='paiv',
-   packages=['arrival']
+   packages=['arrival'],
+   ext_modules=[galaxy],
 )
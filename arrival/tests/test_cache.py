@@ -0,0 +1,35 @@
+from arrival.cache import InteractionCache
+from arrival.galaxy import Galaxy, LocalAlienProxy
+
+
+def test_lookups_update_lru_without_commit(tmp_path):
+    cache = InteractionCache(tmp_path / 'cache.sqlite', limit=2)
+    a, b, c = (cache.key([i]) for i in range(3))
+    cache.put(a, [1])
+    cache.put(b, [2])
+    assert cache.get(a) == [1]
+    assert not cache.db.in_transaction
+    cache.put(c, [3])
+    assert cache.get(b) is None
+    assert cache.get(a) == [1]
+    cache.close()
+
+    cache = InteractionCache(tmp_path / 'cache.sqlite', limit=2)
+    assert cache.get(a) == [1]
+    assert cache.get(c) == [3]
+    cache.close()
+
+
+def test_equal_states_share_cache_key(tmp_path):
+    galaxy = Galaxy(alien=LocalAlienProxy(), cache=tmp_path / 'cache.sqlite')
+    calls = list()
+    def evaluate(state, event):
+        calls.append(state)
+        return [0, state, []]
+    galaxy._evaluate_uncached = evaluate
+
+    x = [1, [2, 3]]
+    assert galaxy._evaluate([x, x], (0, 0)) == [0, [x, x], []]
+    assert galaxy._evaluate([[1, [2, 3]], [1, [2, 3]]], (0, 0)) == [0, [x, x], []]
+    assert len(calls) == 1
+    galaxy.close()
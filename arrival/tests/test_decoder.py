@@ -0,0 +1,31 @@
+import numpy as np
+from arrival.decoder import OcrCache, _ocr_file, batch_ocr, encode_number, number_atlas, ocr_image
+
+
+def test_batch_ocr_duplicate_images(tmp_path):
+    files = [tmp_path / f'{name}.png' for name in 'abcd']
+    number_atlas([1, 2, 3], pad=2).save(files[0])
+    number_atlas([1, 2, 3], pad=2).save(files[1])
+    number_atlas([4, 5], pad=2).save(files[2])
+    number_atlas([-6, 7, 8], pad=2).save(files[3])
+    expect = [(fn, _ocr_file(fn)) for fn in files]
+
+    cache = OcrCache(tmp_path / 'cache.json')
+    assert list(batch_ocr(files, cache=cache, jobs=2)) == expect
+    assert len(cache.entries) == 3
+    assert list(batch_ocr(files, cache=cache, jobs=2)) == expect
+
+    cache.save()
+    cache = OcrCache(tmp_path / 'cache.json')
+    assert list(batch_ocr(files, cache=cache, jobs=2)) == expect
+
+
+def test_number_atlas_ocr_roundtrip():
+    for ns, columns in [([1, 2**40, 3, 7], 16), (range(40), 8), (range(-40, 40), 8), ([-2**62, 0, 2**62], 2)]:
+        assert [n for n, _ in ocr_image(number_atlas(ns, columns=columns))] == list(ns)
+
+
+def test_encode_number_numpy_ints():
+    for n in [0, 5, -5, 2**40, -2**62]:
+        for x in [np.int64(n), np.array([n])[0]]:
+            assert np.array_equal(encode_number(x), encode_number(n))
@@ -0,0 +1,17 @@
+from arrival.galaxy import BOOT_SEQUENCE, FrameData, Galaxy, LocalAlienProxy, MachineImage
+
+
+def test_machine_image():
+    MachineImage().run_tests()
+
+
+def test_lazy_frames_match_eager_frames():
+    eager = Galaxy(alien=LocalAlienProxy())
+    lazy = Galaxy(alien=LocalAlienProxy(), lazy_frames=True)
+    for mouse in BOOT_SEQUENCE:
+        eager.eval_step(mouse)
+        lazy.eval_step(mouse)
+        assert isinstance(lazy.frame, FrameData)
+        assert list(lazy.frame) == eager.frame
+        assert bool(lazy.frame) == bool(eager.frame)
+        assert lazy.state == eager.state
@@ -0,0 +1,19 @@
+import subprocess
+import sys
+
+
+def _run(code):
+    return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()
+
+
+def test_submodules_resolve_after_package_import():
+    assert _run('import arrival; print(arrival.galaxy.__name__, arrival.session.Step.__name__)') == ['arrival.galaxy', 'Step']
+
+
+def test_exports_stay_lazy():
+    code = 'import sys, arrival; arrival.ConsCodec; print("arrival.galaxy" in sys.modules, "numpy" in sys.modules)'
+    assert _run(code) == ['False', 'False']
+
+
+def test_unknown_attribute():
+    assert _run('import arrival; print(hasattr(arrival, "nope"))') == ['False']
@@ -0,0 +1,70 @@
+import pytest
+from arrival import MachineImage, _galaxy
+
+T = MachineImage.TOKENS
+
+
+def _call(fun, *args):
+    image = [T['ap']] * len(args) + [T['FUN'], fun]
+    for x in args:
+        image += x
+    return image
+
+
+def _number(n):
+    return [T['number'], n]
+
+
+def _list(xs):
+    return MachineImage().encode_lists(xs)
+
+
+def _evaluate(image):
+    start = _galaxy.eval_stats()[0]
+    res = _galaxy.evaluate_image(image)
+    return MachineImage().decode_lists(res + [T['GG']]), _galaxy.eval_stats()[0] - start
+
+
+@pytest.fixture
+def galaxy():
+    _galaxy.load_machine()
+    yield _galaxy
+    _galaxy.native_mode(1)
+
+
+@pytest.mark.parametrize('mode', [0, 1, 2])
+def test_lazy_arguments_stay_unevaluated(galaxy, mode):
+    galaxy.native_mode(mode)
+    # length of range 3000, thousands of reductions when it is evaluated
+    costly = _call(1128, _call(1138, _number(3000)))
+
+    # foldr with f never touches the accumulator
+    res, cheap = _evaluate(_call(1133, _list([1, 2, 3]), _number(0), [T['f']]))
+    assert res == 1
+    res, lazy = _evaluate(_call(1133, _list([1, 2, 3]), costly, [T['f']]))
+    assert (res, lazy) == (1, cheap)
+
+    res, forced = _evaluate(_call(1133, _list([1, 2, 3]), costly, [T['t']]))
+    assert (res, forced > 1000) == (3000, True)
+
+
+def test_natives_agree_with_interpreter(galaxy):
+    cases = [
+        _call(1133, _list([1, 2, 3]), _call(1128, _call(1138, _number(50))), [T['f']]),
+        _call(1128, _call(1126, _list([1, 2, 3]), [T['neg']])),
+        _call(1131, _list([1, 2]), _call(1138, _number(3))),
+        _call(1141, _call(1138, _number(10)), _number(7)),
+    ]
+    results = list()
+    for mode in [0, 1, 2]:
+        galaxy.native_mode(mode)
+        results.append([_evaluate(x)[0] for x in cases])
+    assert results[0] == results[1] == results[2]
+
+
+def test_repeated_calls_on_loaded_galaxy(galaxy):
+    # one load_machine, the rom is restored after every call
+    image = _call(1141, _call(1126, _call(1138, _number(20)), [T['neg']]), _number(7))
+    runs = [_evaluate(image) for _ in range(3)]
+    assert runs == [runs[0]] * 3
+    assert runs[0][1] > 0
@@ -0,0 +1,29 @@
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'galaxy'))
+from preprocess import PreprocessError, Preprocessor
+
+
+def test_compiles_definitions():
+    tokens, machine = Preprocessor().parses(':1 = ap neg 2\ngalaxy = :1\n')
+    assert machine == [
+        tokens['SCAN'], 7, tokens['FUN'], 1, tokens['DEF'], tokens['ap'], tokens['neg'], tokens['number'], 2,
+        tokens['SCAN'], 5, tokens['galaxy'], 0, tokens['DEF'], tokens['FUN'], 1,
+        tokens['GG'],
+    ]
+
+
+@pytest.mark.parametrize('code, line, message', [
+    ('galaxy = ap REF 0\n', 1, "unknown token 'REF'"),
+    ('galaxy = ap foo 1\n', 1, "unknown token 'foo'"),
+    (':1 = 1\n:1 = 2\n', 2, ':1 redefined'),
+    ('galaxy = :2\n', 1, 'undefined :2'),
+    ('\n:1\n', 2, 'expected'),
+])
+def test_rejects_bad_source(code, line, message):
+    with pytest.raises(PreprocessError) as e:
+        Preprocessor().parses(code)
+    assert e.value.line == line
+    assert message in e.value.message
@@ -0,0 +1,60 @@
+import ctypes
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from arrival import MachineImage
+
+GALAXY_DIR = Path(__file__).parent.parent / 'galaxy'
+sys.path.insert(0, str(GALAXY_DIR))
+from preprocess import Preprocessor
+from profiler import Profile
+
+
+@pytest.fixture(scope='module')
+def libgalaxy(tmp_path_factory):
+    if shutil.which('g++') is None:
+        pytest.skip('no c++ compiler')
+    fn = tmp_path_factory.mktemp('profile') / 'libgalaxy.so'
+    subprocess.run(['g++', '-std=c++17', '-O1', '-fPIC', '-shared', '-DGALAXY_PROFILE=1',
+        str(GALAXY_DIR / 'galaxy.cpp'), '-o', str(fn)], check=True)
+    lib = ctypes.cdll.LoadLibrary(str(fn))
+    p64 = ctypes.POINTER(ctypes.c_int64)
+    lib.load_machine.argtypes = (p64,)
+    lib.evaluate.argtypes = (ctypes.c_uint32, p64)
+    lib.evaluate.restype = p64
+    lib.galaxy_profile.argtypes = (ctypes.POINTER(ctypes.c_uint32),)
+    lib.galaxy_profile.restype = p64
+    return lib
+
+
+def _image(xs):
+    return (ctypes.c_int64 * len(xs))(*xs)
+
+
+def test_work_is_charged_to_owning_definition(libgalaxy):
+    code = ''.join([
+        ':1001 = 7\n',
+        ':1002 = ap ap add ap neg 3 ap ap mul 2 :1001\n',
+        'galaxy = :1002\n',
+    ])
+    _, machine = Preprocessor().parses(code)
+    libgalaxy.load_machine(_image(machine))
+    libgalaxy.galaxy_profile_reset()
+
+    request = [MachineImage.TOKENS['FUN'], 1002]
+    res = libgalaxy.evaluate(len(request), _image(request))
+    assert MachineImage().decode_lists(res) == 11
+
+    size = ctypes.c_uint32()
+    dump = libgalaxy.galaxy_profile(ctypes.byref(size))
+    profile = Profile(dump[:size.value])
+    calls, reductions, nbytes = profile.functions[1002]
+    # add, neg, mul and the expansion of :1001
+    assert (calls, reductions) == (1, 4)
+    assert nbytes > 0
+    assert profile.functions[1001] == (1, 0, 0)
+    assert profile.functions[-1][:2] == (0, 1)
+    assert sum(profile.reductions) == sum(r for _, r, _ in profile.functions.values())
+    assert profile.alloc_bytes == sum(b for _, _, b in profile.functions.values())
@@ -0,0 +1,63 @@
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from arrival import MachineImage, _galaxy
+
+GALAXY_DIR = Path(__file__).parent.parent / 'galaxy'
+sys.path.insert(0, str(GALAXY_DIR))
+from preprocess import Preprocessor
+
+T = MachineImage.TOKENS
+CODE = ':1 = ap ap cons 7 nil\n:2 = ap ap add 1 ap car :1\ngalaxy = :1\n'
+
+
+@pytest.fixture
+def machine():
+    _, image = Preprocessor().parses(CODE)
+    _galaxy.load_machine(image)
+    yield image
+    _galaxy.load_machine()
+
+
+def test_evaluate_twice_on_loaded_machine(machine):
+    runs = list()
+    for _ in range(3):
+        start = _galaxy.eval_stats()[0]
+        res = _galaxy.evaluate_image([T['FUN'], 2])
+        runs.append((MachineImage().decode_lists(res + [T['GG']]), _galaxy.eval_stats()[0] - start))
+    # rom memos do not outlive the call, every run does the same work
+    assert runs == [(8, runs[0][1])] * 3
+    assert runs[0][1] > 0
+
+
+DRIVER = '''
+#include "galaxy.cpp"
+int main() {
+    static const i64 image[] = {%s};
+    static const i64 request[] = {%d, 1};
+    load_machine(image);
+    for (int i = 0; i < 3; ++i) {
+        const i64* res = evaluate(2, request);
+        if (res == nullptr || res[0] != %d) {
+            return 1;
+        }
+    }
+    return 0;
+}
+'''
+
+
+def test_evaluate_twice_under_asan(machine, tmp_path):
+    if shutil.which('g++') is None:
+        pytest.skip('no c++ compiler')
+    src = tmp_path / 'driver.cpp'
+    src.write_text(DRIVER % (', '.join(map(str, machine)), T['FUN'], T['ap']))
+    exe = tmp_path / 'driver'
+    build = subprocess.run(['g++', '-std=c++17', '-O1', '-g', '-fsanitize=address', '-I', str(GALAXY_DIR),
+        str(src), '-o', str(exe)], capture_output=True)
+    if build.returncode != 0:
+        pytest.skip('no address sanitizer')
+    run = subprocess.run([str(exe)], capture_output=True, text=True)
+    assert run.returncode == 0, run.stderr
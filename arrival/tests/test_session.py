@@ -0,0 +1,51 @@
+from arrival.galaxy import Galaxy, MachineData, MachineImage
+from arrival.session import ALIEN_REQUEST, ALIEN_RESPONSE, FRAME, STEP, SessionRecorder, read_session
+
+
+class ModulatedProxy:
+    modulated = True
+
+    def __init__(self):
+        self.sent = list()
+
+    def send(self, data):
+        self.sent.append(data)
+        return MachineData(MachineImage().encode_lists([1, [2, 3]]))
+
+
+class Backend:
+    # one alien round trip, then a frame
+    __file__ = __file__
+
+    def __init__(self):
+        self.calls = list()
+
+    def native_mode(self, mode):
+        pass
+
+    def evaluate(self, state, event, raw_data=False, raw_images=False):
+        self.calls.append((event, raw_data))
+        if len(self.calls) == 1:
+            return [1, [7], MachineImage().encode_lists([0, (5, 6)])]
+        return [0, [8], [[(1, 1)]]]
+
+
+def test_recorder_keeps_modulated_path(tmp_path):
+    proxy = ModulatedProxy()
+    recorder = SessionRecorder(tmp_path / 'session.trace')
+    galaxy = Galaxy(alien=proxy, recorder=recorder)
+    galaxy.galexy = Backend()
+    assert galaxy.alien.modulated
+
+    galaxy.eval_step((3, 4))
+    recorder.close()
+
+    assert [raw for _, raw in galaxy.galexy.calls] == [True, True]
+    assert isinstance(proxy.sent[0], MachineData)
+    assert isinstance(galaxy.galexy.calls[1][0], MachineData)
+    assert list(read_session(tmp_path / 'session.trace')) == [
+        (STEP, [[], (3, 4)]),
+        (ALIEN_REQUEST, [0, (5, 6)]),
+        (ALIEN_RESPONSE, [1, [2, 3]]),
+        (FRAME, [[8], [[(1, 1)]]]),
+    ]